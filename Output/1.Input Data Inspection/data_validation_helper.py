@@ -2,47 +2,16 @@
 # Date: 25/02/2022
 # This module is built to help validation job
 
-import glob
 import pandas as pd
 import os
-import re
 import numpy as np
-
-def get_file_list(folder_path, file_pattern):
-    """
-    Get a list to show all files under the folder 
-    :param folder_path: folder path for lookup
-    :param file_pattern: file pattern for lookup
-    :return: list with file paths
-    """
-    result = [f for f in os.listdir(folder_path) if re.search(file_pattern, f)]
-    return result
-
-def get_name_list(folder_path, file_pattern):
-    """
-    Get a list to show all filenames under the folder 
-    :param folder_path: folder path for lookup
-    :param file_pattern: file pattern for lookup
-    :return: list with filenames
-    """
-    result = []
-    for path in glob.glob(f"{folder_path}\\{file_pattern}"):
-        nmi = os.path.basename(path).split(".")[0]
-        result.append(nmi)
-    return result
-
-def get_file_dict(folder_path, file_pattern):
-    """
-    Get a dictonary to list all files under the folder 
-    :param folder_path: folder path for lookup
-    :param file_pattern: file pattern for lookup
-    :return: dictionary with file name as key and file path as value
-    """
-    result = {}
-    for path in glob.glob(f"{folder_path}\\{file_pattern}"):
-        nmi = os.path.basename(path).split(".")[0]
-        result[nmi] = path
-    return result
+import csv
+import math
+import random
+import sqlite3
+from statistics import NormalDist
+from file_helper import (get_file_list, get_name_list, get_file_dict, check_file_format,
+                         check_unique, check_missing_nmi, check_missing_consumption)
 
 def load_csv(file_path, file_name):
     """
@@ -89,39 +58,6 @@ def check_columns(df, expected_columns):
     else:
         print(f"{df.columns.name} does not show corrent data format as {expected_columns}.")
 
-def check_file_format(input_list, expected_format):
-    """
-    Check file format is as expected
-    :param input_lis: input list 
-    :param expected_format: expected file format
-    """
-    if len(input_list) == 0:
-        print(f"All items are {expected_format}")
-    else:
-        print(f"Have {len(input_list)} items are not {expected_format}.")
-
-def check_unique(file_list):
-    """
-    Check file content is as expected
-    :param file_list: input list 
-    """
-    if len(file_list) == len(set(file_list)):
-        print(f"All items are unique.")
-    else:
-        print(f"Some items are not unqiue.")
-    
-def check_missing_nmi(input_list, compared_list):
-    """
-    Check nmi has consumption data but is missing from nmi master file
-    :param input_list: all nmis from master file
-    :param compared_list: all nmis has consumption data
-    """
-    missing_nmi = []
-    for item in input_list:
-        if item not in compared_list:
-            missing_nmi.append(item)
-    print(f"Each nmi in {missing_nmi} is missing from nmi master file but has consumption data.")
-    
 def check_missing_data(df):
     """
     Check input dataframe contains missing data or not
@@ -132,18 +68,6 @@ def check_missing_data(df):
     else:
         print(f"{df.columns.name} does not have missing data.")
     
-def check_missing_consumption(input_list, compared_list):
-    """
-    Check nmi from nmi master file is missing consumption data
-    :param input_list: all nmis has consumption data
-    :param compared_list: all nmis from master file 
-    """
-    missing_consumption = []
-    for item in input_list:
-        if item not in compared_list:
-            missing_consumption.append(item)
-    print(f"Each nmi in {missing_consumption} in nmi master file does not have consumption data.")
-    
 def check_column_type(df,column_name,expected_type):
     """
     Check data frame column has expected data type
@@ -229,4 +153,404 @@ def check_datetime_freq(df, date_column):
         freq = pd.infer_freq(df.index[pos: pos + 3])
         print(f"{df.columns.name} shows consistent inverval as {freq}.")
     except Exception:
-        print(f"{df.columns.name} shows inconsistent inverval")
\ No newline at end of file
+        print(f"{df.columns.name} shows inconsistent inverval")
+
+def check_catalog(catalog_db, interval_dict=None, nmi_list=None):
+    """
+    Check row count, interval, gaps and outliers of each nmi from the statistics
+    catalog written by data_transform_helper, without scanning consumption files
+    :param catalog_db: catalog database file
+    :param interval_dict: dictionary with nmi as key and expected interval in minutes as value
+    :param nmi_list: nmis to check, all nmis in the catalog if None
+    :return: list of dictionaries with nmi statistics
+    """
+    result = _read_catalog(catalog_db, nmi_list)
+    for stats in result:
+        name = stats['NMI']
+        print(f"{name} has {stats['ROWS']} rows from {stats['FIRST_LOCALTIME']} to {stats['LAST_LOCALTIME']}.")
+        expected = interval_dict.get(name) if interval_dict else None
+        if expected is None:
+            print(f"{name} shows inverval as {stats['INTERVAL']} minutes.")
+        elif stats['INTERVAL'] == float(expected):
+            print(f"{name} has consistent data with interval {expected} minutes defined in the master file.")
+        else:
+            print(f"{name} has inconsistent data with interval {expected} minutes defined in the master file.")
+        if stats['GAPS'] == 0:
+            print(f"{name} does not have gaps.")
+        else:
+            print(f"{name} has gaps as {stats['GAPS']} with {stats['MISSING_INTERVALS']} missing intervals.")
+        if stats['OUTLIERS'] == 0:
+            print(f"{name} does not have outliers.")
+        else:
+            print(f"{name} has outliers as {stats['OUTLIERS']}.")
+    return result
+
+def _read_catalog(catalog_db, nmi_list=None):
+    """
+    Read the nmi_stats table of the statistics catalog with plain sqlite3,
+    so this module does not need database_helper
+    :param catalog_db: catalog database file
+    :param nmi_list: nmis to read, all nmis in the catalog if None
+    :return: list of dictionaries with nmi statistics
+    """
+    result = []
+    conn = None
+    try:
+        conn = sqlite3.connect(catalog_db)
+        cur = conn.execute("SELECT * FROM nmi_stats ORDER BY NMI")
+        names = [column[0] for column in cur.description]
+        result = [dict(zip(names, row)) for row in cur.fetchall()]
+    except sqlite3.Error as e:
+        print(e)
+    finally:
+        if conn is not None:
+            conn.close()
+    if nmi_list is not None:
+        result = [stats for stats in result if stats['NMI'] in nmi_list]
+    return result
+
+def _get_unchanged_stats(catalog_db, file_dict):
+    """
+    Get catalog statistics of the files unchanged since the catalog was written,
+    comparing size and mtime only
+    :param catalog_db: catalog database file
+    :param file_dict: dictionary with file name as key and file path as value
+    :return: dictionary with file name as key and nmi statistics as value
+    """
+    result = {}
+    for stats in _read_catalog(catalog_db, list(file_dict)):
+        stat = os.stat(file_dict[stats['NMI']])
+        if (stats['SOURCE_SIZE'], stats['SOURCE_MTIME']) == (stat.st_size, stat.st_mtime):
+            result[stats['NMI']] = stats
+    return result
+
+def _sniff_head(file_path, sample_bytes=65536, encoding='utf-8'):
+    """
+    Detect csv dialect and header from the first bytes of a file
+    :param file_path: input file path for lookup
+    :param sample_bytes: number of bytes to read from the start of the file
+    :param encoding: file encoding
+    :return: tuple with csv dialect and header list
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(sample_bytes).decode(encoding, errors='replace')
+    # drop the trailing partial line so the sniffer only sees complete rows
+    lines = head.splitlines()
+    if len(lines) > 1 and not head.endswith(('\n', '\r')):
+        lines = lines[:-1]
+    try:
+        dialect = csv.Sniffer().sniff('\n'.join(lines), delimiters=',;|\t')
+    except csv.Error:
+        dialect = csv.excel
+    header = next(csv.reader(lines[:1], dialect), [])
+    return dialect, header
+
+def _stratified_sample(file_path, dialect, strata=20, block_size=50, encoding='utf-8'):
+    """
+    Sample blocks of consecutive rows from evenly spaced byte offsets of a file
+    :param file_path: input file path for lookup
+    :param dialect: csv dialect detected from the file head
+    :param strata: number of evenly spaced blocks to read
+    :param block_size: number of consecutive rows in each block
+    :param encoding: file encoding
+    :return: tuple with list of row blocks, data row count (estimated unless covered)
+             and whether the sample covers the whole file
+    """
+    file_size = os.path.getsize(file_path)
+    blocks = []
+    read_rows = 0
+    read_bytes = 0
+    last_end = 0
+    with open(file_path, 'rb') as f:
+        header_line = f.readline()
+        data_start = f.tell()
+        for i in range(strata):
+            offset = data_start + (file_size - data_start) * i // strata
+            # skip strata that start inside a block already read (small files)
+            offset = max(offset, last_end)
+            if offset >= file_size:
+                break
+            f.seek(offset)
+            if offset != data_start and offset != last_end:
+                f.readline()
+            lines = []
+            for _ in range(block_size):
+                line = f.readline()
+                if not line:
+                    break
+                read_bytes += len(line)
+                lines.append(line.decode(encoding, errors='replace'))
+            last_end = f.tell()
+            rows = [row for row in csv.reader(lines, dialect) if row]
+            read_rows += len(rows)
+            if rows:
+                blocks.append(rows)
+    covered = read_bytes == file_size - data_start
+    if read_rows == 0:
+        return blocks, 0, covered
+    if covered:
+        # blocks are contiguous, so keep them as one block for the interval check
+        return [sum(blocks, [])] if blocks else [], read_rows, True
+    estimated_rows = int(round((file_size - len(header_line)) / (read_bytes / read_rows)))
+    return blocks, estimated_rows, False
+
+def _reservoir_sample(file_path, dialect, sample_size=1000, seed=None, encoding='utf-8'):
+    """
+    Sample pairs of consecutive rows uniformly from a file with reservoir sampling.
+    It reads every line to get the exact row count, so it is slower than the
+    stratified sample and is meant for when an exact count is needed
+    :param file_path: input file path for lookup
+    :param dialect: csv dialect detected from the file head
+    :param sample_size: number of consecutive row pairs to keep
+    :param seed: random seed for a reproducible sample
+    :param encoding: file encoding
+    :return: tuple with list of row pairs (or one block with all rows when covered),
+             exact data row count and whether the sample covers the whole file
+    """
+    rng = random.Random(seed)
+    reservoir = []
+    total_rows = 0
+    previous = None
+    # Algorithm L: draw the index of the next pair to keep instead of a random number per line
+    weight = math.exp(math.log(rng.random()) / sample_size)
+    next_index = sample_size + int(math.log(rng.random()) / math.log(1 - weight))
+    with open(file_path, 'rb') as f:
+        f.readline()
+        for line in f:
+            if not line.strip():
+                continue
+            total_rows += 1
+            if previous is not None:
+                # each item is a (previous line, line) pair so intervals can be checked
+                index = total_rows - 2
+                if index < sample_size:
+                    reservoir.append((previous, line))
+                elif index == next_index:
+                    reservoir[rng.randrange(sample_size)] = (previous, line)
+                    weight *= math.exp(math.log(rng.random()) / sample_size)
+                    next_index += int(math.log(rng.random()) / math.log(1 - weight)) + 1
+            previous = line
+
+    def parse(lines):
+        return [row for row in csv.reader([line.decode(encoding, errors='replace') for line in lines], dialect) if row]
+
+    if total_rows == 0:
+        return [], 0, True
+    if total_rows - 1 <= sample_size:
+        lines = [previous] if total_rows == 1 else [reservoir[0][0]] + [pair[1] for pair in reservoir]
+        return [parse(lines)], total_rows, True
+    return [parse(pair) for pair in reservoir], total_rows, False
+
+def _wilson_bounds(failures, trials, confidence=0.95):
+    """
+    Get the Wilson score interval for a failure rate observed in a sample
+    :param failures: number of failed rows in the sample
+    :param trials: number of rows in the sample
+    :param confidence: confidence level of the interval
+    :return: tuple with lower and upper bound of the failure rate
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = failures / trials
+    denominator = 1 + z ** 2 / trials
+    centre = (p + z ** 2 / (2 * trials)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / trials + z ** 2 / (4 * trials ** 2)) / denominator
+    lower = 0.0 if failures == 0 else max(0.0, centre - margin)
+    upper = 1.0 if failures == trials else min(1.0, centre + margin)
+    return lower, upper
+
+def _check_sample(blocks, header, expected_units, interval, pair_mode=False, case_sensitive=False):
+    """
+    Run value, unit, type and frequency checks on sampled row blocks
+    :param blocks: list of consecutive row blocks
+    :param header: csv header of the file
+    :param expected_units: expected unit values
+    :param interval: expected interval in minutes, inferred from the sample if None
+    :param pair_mode: blocks are sampled row pairs, only the second row of each pair is
+                      counted in row checks so overlapping pairs do not count a row twice
+    :param case_sensitive: compare units case sensitively
+    :return: dictionary with check name as key and (failures, trials) as value
+    """
+    frames = []
+    for block_id, rows in enumerate(blocks):
+        frame = pd.DataFrame([row[:len(header)] for row in rows], columns=header)
+        frame['BLOCK'] = block_id
+        frame['POSITION'] = range(len(frame))
+        frames.append(frame)
+    df = pd.concat(frames, ignore_index=True)
+    time_column, quantity_column, unit_column = header[:3]
+
+    if interval is not None:
+        # intervals read from the master file are strings
+        interval = float(interval)
+    times = pd.to_datetime(df[time_column], errors='coerce')
+    steps = times.groupby(df['BLOCK']).diff().dropna()
+    if interval is None and len(steps) > 0:
+        interval = steps.mode().iloc[0] / pd.Timedelta(minutes=1)
+    if pair_mode:
+        df = df[df['POSITION'] == 1]
+        times = times[df.index]
+
+    quantities = pd.to_numeric(df[quantity_column], errors='coerce')
+    units = df[unit_column].fillna('').str.strip()
+    if not case_sensitive:
+        units = units.str.upper()
+        expected_units = [unit.upper() for unit in expected_units]
+    missing = df[header[:3]].isnull().any(axis=1) | (df[header[:3]] == '').any(axis=1)
+
+    result = {}
+    result['missing'] = (int(missing.sum()), len(df))
+    result['time_type'] = (int((times.isnull() & ~missing).sum()), len(df))
+    result['quantity_type'] = (int((quantities.isnull() & ~missing).sum()), len(df))
+    result['unit_value'] = (int((~units.isin(expected_units) & ~missing).sum()), len(df))
+    result['quantity_value'] = (int((quantities < 0).sum()), len(df))
+    if interval is not None:
+        result['frequency'] = (int((steps != pd.Timedelta(minutes=interval)).sum()), len(steps))
+    else:
+        result['frequency'] = (0, 0)
+    return result, interval
+
+def _full_scan(file_path, file_name, expected_header, expected_units, case_sensitive=False):
+    """
+    Run the full validation checks on a file
+    :param file_path: input file path for lookup
+    :param file_name: input file name for reporting
+    :param expected_header: expected header list
+    :param expected_units: expected unit values
+    :param case_sensitive: compare units case sensitively, as in the preflight sample
+    """
+    check_header(file_path, expected_header)
+    if pd.read_csv(file_path, nrows=0).columns.tolist() != expected_header:
+        return
+    df = load_csv(file_path, file_name)
+    check_missing_data(df)
+    check_column_type(df, expected_header[1], 'float64')
+    if case_sensitive:
+        check_value(df, expected_header[2], expected_units)
+    else:
+        unit_df = df[[expected_header[2]]].copy()
+        unit_df[expected_header[2]] = unit_df[expected_header[2]].str.upper()
+        unit_df.columns.name = file_name
+        check_value(unit_df, expected_header[2], [unit.upper() for unit in expected_units])
+    check_duplicate_rows(df.copy())
+    check_datetime_freq(df.copy(), expected_header[0])
+    check_outlier(df, expected_header[1])
+
+def _get_sample_trials(method, sample_size):
+    """
+    Get the fewest trials any check gets from a sample that does not cover the file
+    :param method: 'stratified' or 'reservoir'
+    :param sample_size: approximate number of rows to sample from each file
+    :return: number of trials
+    """
+    if method == 'reservoir':
+        return sample_size
+    # stratified blocks lose one interval step per block in the frequency check
+    strata = max(1, sample_size // 50)
+    return strata * (sample_size // strata - 1)
+
+def preflight_check(file_dict, expected_header=['AESTTime', 'Quantity', 'Unit'],
+                    expected_units=['WH', 'KWH', 'MWH'], interval_dict=None,
+                    method='stratified', sample_size=1000, confidence=0.95,
+                    tolerance=0.01, full_scan=True, seed=None, case_sensitive=False, catalog_db=None):
+    """
+    Fast preflight validation of consumption files on a sample of each file,
+    escalating to a full scan only for files whose sample looks suspicious
+    :param file_dict: dictionary with file name as key and file path as value
+    :param expected_header: expected header list
+    :param expected_units: expected unit values
+    :param interval_dict: dictionary with file name as key and interval in minutes as value
+    :param method: 'stratified' (default) reads evenly spaced blocks and only touches the sampled bytes,
+                   'reservoir' samples row pairs uniformly and reads every line for an exact row count
+    :param sample_size: approximate number of rows to sample from each file
+    :param confidence: confidence level of the reported failure rate bounds
+    :param tolerance: highest acceptable upper bound of any failure rate. Even a clean sample has
+                      an upper bound above zero, so sample_size must be large enough for that bound
+                      to fall under tolerance (about 390 rows for 0.01 at 95% confidence),
+                      otherwise every file not covered by its sample would be escalated
+    :param full_scan: run the full checks on suspicious files
+    :param seed: random seed for reservoir sampling
+    :param case_sensitive: compare units case sensitively in both sample and full scan
+    :param catalog_db: if set, files unchanged since the statistics catalog was written still get the
+                       stratified header, unit and type sample, but take gaps and interval from the
+                       catalog instead of an exact read, and are suspicious if the catalog shows gaps
+                       or an interval other than interval_dict. The catalog is built from the cleaned
+                       transform output, so it cannot vouch for the raw values on its own
+    :return: dictionary with file name as key and preflight report as value,
+             failure rates are exact when the sample covers the whole file.
+             'rows' is the raw data row count of the file (estimated unless exact), while
+             'catalog_rows' is the cleaned row count after transform from the catalog
+    """
+    trials = _get_sample_trials(method, sample_size)
+    if catalog_db is not None:
+        trials = min(trials, _get_sample_trials('stratified', sample_size))
+    if _wilson_bounds(0, trials, confidence)[1] > tolerance:
+        raise ValueError(f"sample_size {sample_size} is too small for tolerance {tolerance}: "
+                         f"a clean sample of {trials} rows has a failure rate upper bound of "
+                         f"{_wilson_bounds(0, trials, confidence)[1]:.4f}")
+    if interval_dict is None:
+        interval_dict = {}
+    catalog = {}
+    if catalog_db is not None:
+        catalog = _get_unchanged_stats(catalog_db, file_dict)
+    result = {}
+    for name, path in file_dict.items():
+        dialect, header = _sniff_head(path)
+        report = {'delimiter': dialect.delimiter,
+                  'header': header,
+                  'header_valid': header == expected_header,
+                  'checks': {},
+                  'exact': False,
+                  'catalog': name in catalog,
+                  'suspicious': False,
+                  'full_scan': False}
+
+        if report['catalog']:
+            stats = catalog[name]
+            print(f"{name} is unchanged since the catalog was written, taking gaps and interval from the catalog.")
+            report.update({'catalog_rows': stats['ROWS'], 'catalog_interval': stats['INTERVAL'],
+                           'gaps': stats['GAPS'], 'missing_intervals': stats['MISSING_INTERVALS'],
+                           'outliers': stats['OUTLIERS']})
+            expected = interval_dict.get(name)
+            if stats['GAPS'] > 0 or (expected is not None and stats['INTERVAL'] != float(expected)):
+                report['suspicious'] = True
+
+        if report['header_valid']:
+            # the catalog already gives gaps and interval, so an exact read is not needed
+            reservoir = method == 'reservoir' and not report['catalog']
+            if reservoir:
+                blocks, rows, covered = _reservoir_sample(path, dialect, sample_size, seed)
+            else:
+                strata = max(1, sample_size // 50)
+                blocks, rows, covered = _stratified_sample(path, dialect, strata, sample_size // strata)
+            report['rows'] = rows
+            report['exact'] = covered
+            if blocks:
+                pair_mode = reservoir and not covered
+                checks, interval = _check_sample(blocks, header, expected_units, interval_dict.get(name),
+                                                 pair_mode, case_sensitive)
+                report['interval'] = interval
+                for check, (failures, trials) in checks.items():
+                    if covered:
+                        lower = upper = failures / trials if trials > 0 else 0.0
+                    else:
+                        lower, upper = _wilson_bounds(failures, trials, confidence)
+                    report['checks'][check] = {'failures': failures, 'sampled': trials,
+                                               'lower': lower, 'upper': upper}
+                    if failures > 0 or upper > tolerance:
+                        report['suspicious'] = True
+            else:
+                report['suspicious'] = True
+        else:
+            report['suspicious'] = True
+
+        if report['suspicious']:
+            print(f"{name} looks suspicious in preflight sample.")
+            if full_scan:
+                _full_scan(path, name, expected_header, expected_units, case_sensitive)
+                report['full_scan'] = True
+        else:
+            print(f"{name} passes preflight sample checks.")
+        result[name] = report
+    return result
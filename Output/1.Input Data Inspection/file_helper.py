@@ -0,0 +1,146 @@
+# Date: 19/10/2026
+# This module is built to help file discovery job, it only imports standard
+# libraries so it stays fast to import; pandas based jobs live in
+# data_validation_helper and data_transform_helper
+
+import csv
+import glob
+import json
+import os
+import re
+
+def get_file_list(folder_path, file_pattern):
+    """
+    Get a list to show all files under the folder 
+    :param folder_path: folder path for lookup
+    :param file_pattern: file pattern for lookup
+    :return: list with file paths
+    """
+    result = [f for f in os.listdir(folder_path) if re.search(file_pattern, f)]
+    return result
+
+def get_name_list(folder_path, file_pattern):
+    """
+    Get a list to show all filenames under the folder 
+    :param folder_path: folder path for lookup
+    :param file_pattern: file pattern for lookup
+    :return: list with filenames
+    """
+    result = []
+    for path in glob.glob(f"{folder_path}\\{file_pattern}"):
+        nmi = os.path.basename(path).split(".")[0]
+        result.append(nmi)
+    return result
+
+def get_file_dict(folder_path, file_pattern):
+    """
+    Get a dictonary to list all files under the folder 
+    :param folder_path: folder path for lookup
+    :param file_pattern: file pattern for lookup
+    :return: dictionary with file name as key and file path as value
+    """
+    result = {}
+    for path in glob.glob(f"{folder_path}\\{file_pattern}"):
+        nmi = os.path.basename(path).split(".")[0]
+        result[nmi] = path
+    return result
+
+def get_file_inventory(folder_path, file_pattern):
+    """
+    Get an inventory of all files under the folder with size and modified time
+    :param folder_path: folder path for lookup
+    :param file_pattern: file pattern for lookup
+    :return: dictionary with file name as key and file path, size and mtime as value
+    """
+    result = {}
+    for name, path in get_file_dict(folder_path, file_pattern).items():
+        stat = os.stat(path)
+        result[name] = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime}
+    return result
+
+def write_manifest(inventory, manifest_file):
+    """
+    Save file inventory as json manifest
+    :param inventory: file inventory from get_file_inventory
+    :param manifest_file: output manifest file
+    """
+    with open(manifest_file, 'w') as f:
+        json.dump(inventory, f, indent=2, sort_keys=True)
+
+def check_manifest(inventory, manifest_file):
+    """
+    Compare file inventory with a saved json manifest
+    :param inventory: file inventory from get_file_inventory
+    :param manifest_file: manifest file saved by write_manifest
+    :return: dictionary with new, changed and removed file name lists
+    """
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    result = {'new': sorted(name for name in inventory if name not in manifest),
+              'changed': sorted(name for name in inventory if name in manifest
+                                and (inventory[name]['size'], inventory[name]['mtime'])
+                                != (manifest[name]['size'], manifest[name]['mtime'])),
+              'removed': sorted(name for name in manifest if name not in inventory)}
+    if any(result.values()):
+        print(f"{manifest_file} is out of date: {result}.")
+    else:
+        print(f"{manifest_file} matches all files.")
+    return result
+
+def get_nmi_dict(lookup_file, key_column='NMI', value_column='STATE'):
+    """
+    Get nmi info from the master file without loading pandas
+    :param lookup_file: nmi master file (must be .csv)
+    :param key_column: nmi column name
+    :param value_column: column name to return for each nmi
+    :return: dictionary with nmi as key and value_column as value
+    """
+    with open(lookup_file, newline='') as f:
+        return {row[key_column]: row[value_column] for row in csv.DictReader(f)}
+
+def check_file_format(input_list, expected_format):
+    """
+    Check file format is as expected
+    :param input_lis: input list 
+    :param expected_format: expected file format
+    """
+    if len(input_list) == 0:
+        print(f"All items are {expected_format}")
+    else:
+        print(f"Have {len(input_list)} items are not {expected_format}.")
+
+def check_unique(file_list):
+    """
+    Check file content is as expected
+    :param file_list: input list 
+    """
+    if len(file_list) == len(set(file_list)):
+        print(f"All items are unique.")
+    else:
+        print(f"Some items are not unqiue.")
+    
+def check_missing_nmi(input_list, compared_list):
+    """
+    Check nmi has consumption data but is missing from nmi master file
+    :param input_list: all nmis from master file
+    :param compared_list: all nmis has consumption data
+    """
+    missing_nmi = []
+    for item in input_list:
+        if item not in compared_list:
+            missing_nmi.append(item)
+    print(f"Each nmi in {missing_nmi} is missing from nmi master file but has consumption data.")
+    
+def check_missing_consumption(input_list, compared_list):
+    """
+    Check nmi from nmi master file is missing consumption data
+    :param input_list: all nmis has consumption data
+    :param compared_list: all nmis from master file 
+    """
+    missing_consumption = []
+    for item in input_list:
+        if item not in compared_list:
+            missing_consumption.append(item)
+    print(f"Each nmi in {missing_consumption} in nmi master file does not have consumption data.")
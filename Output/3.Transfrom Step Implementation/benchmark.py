@@ -0,0 +1,49 @@
+# Date: 19/10/2026
+# This module is built to benchmark cold-start time of the helper modules
+
+import os
+import subprocess
+import sys
+import time
+
+TARGET_MS = 100
+
+COMMANDS = {'python startup': "pass",
+            'discovery (file_helper)': "import file_helper as fh; fh.get_file_inventory({folder!r}, {pattern!r})",
+            'import data_validation_helper': "import data_validation_helper",
+            'import data_transform_helper': "import data_transform_helper"}
+
+def measure_cold_start(code, repeat=5):
+    """
+    Measure wall time of a fresh python process running code
+    :param code: python code to run
+    :param repeat: number of runs, the best one is reported
+    :return: best wall time in milliseconds
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        result.append((time.perf_counter() - start) * 1000)
+    return min(result)
+
+def report_cold_start(folder_path, file_pattern="*.csv", repeat=5):
+    """
+    Print cold-start time of discovery-only commands and heavy imports
+    :param folder_path: folder path for discovery
+    :param file_pattern: file pattern for discovery
+    :param repeat: number of runs per command
+    :return: dictionary with command name as key and time in milliseconds as value
+    """
+    result = {}
+    for name, code in COMMANDS.items():
+        result[name] = measure_cold_start(code.format(folder=folder_path, pattern=file_pattern), repeat)
+        print(f"{name:<32} {result[name]:8.1f} ms")
+    status = "meets" if result['discovery (file_helper)'] < TARGET_MS else "misses"
+    print(f"Discovery cold start {status} the {TARGET_MS} ms target.")
+    return result
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else '..\\1.Input Data Inspection\\Data\\ConsumptionData'
+    report_cold_start(folder)
@@ -4,24 +4,120 @@
 
 import pandas as pd
 import csv
+import codecs
+import math
 import os
-import data_validation_helper as dvh
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import database_helper as dh
+import file_helper as fh
 import numpy as np
 
-def _transform_to_csv(file_path):
-    detected_delimiter = ','
-    with open(file_path, newline='') as f:
-        reader = csv.reader(f)
-        header = next(reader) 
-        row = next(f)
-        
-        sniffer = csv.Sniffer()
-        dialect = sniffer.sniff(row)
-        detected_delimiter = dialect.delimiter
-    
+DEFAULT_TIMEZONE = 'Australia/Brisbane'
+TIMEZONE_DICT = {'VIC': 'Australia/Victoria',
+                 'NSW': 'Australia/NSW',
+                 'SA': 'Australia/Adelaide',
+                 'WA': 'Australia/West',
+                 'TAS':'Australia/Tasmania',
+                 'QLD': 'Australia/Queensland',
+                 'ACT': 'Australia/ACT'}
+# SA local time is offset from AEST by 30 minutes, so calendar keys of every state
+# fall on a grid that divides both the NMI interval and 30 minutes
+LOCAL_OFFSET_MINUTES = 30
+
+def _detect_encoding(sample):
+    """
+    Detect text encoding from a bounded byte sample
+    :param sample: bytes read from the start of the file
+    :return: encoding name
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    # a non final decode accepts a multi-byte character cut at the end of the sample
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+def _sniff_file(file_path, sample_bytes=65536):
+    """
+    Detect encoding and csv dialect from the first bytes of a file
+    :param file_path: input file path
+    :param sample_bytes: number of bytes to read from the start of the file
+    :return: encoding name and csv dialect
+    """
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    encoding = _detect_encoding(sample)
+    lines = sample.decode(encoding, errors='ignore').splitlines()
+    # drop the trailing partial line so the sniffer only sees complete rows
+    if len(sample) == sample_bytes and len(lines) > 1:
+        lines = lines[:-1]
+    try:
+        dialect = csv.Sniffer().sniff('\n'.join(lines), delimiters=',;|\t')
+    except csv.Error:
+        dialect = csv.excel
+    return encoding, dialect
+
+def _transform_to_csv(file_path, output_folder='', sample_bytes=65536):
+    """
+    Rewrite a file as comma separated UTF-8 csv row by row in constant memory,
+    through a temporary file so output_folder can be the input folder
+    :param file_path: input file path
+    :param output folder: output folder to save normalized file
+    :param sample_bytes: number of bytes used to detect encoding and dialect
+    :return: normalized file path, or the input path if it is already canonical
+    """
+    encoding, dialect = _sniff_file(file_path, sample_bytes)
+    if encoding == 'utf-8' and dialect.delimiter == ',':
+        return file_path
+
     file_name = os.path.basename(file_path).split(".")[0]
-    df = dvh.load_csv(file_path, delimiter = detected_delimiter)
-    df.to_csv(f'{file_name}.csv', index = None)
+    output_path = os.path.join(output_folder, f'{file_name}.csv')
+    # skip files normalized after the last change of the input
+    if (os.path.abspath(output_path) != os.path.abspath(file_path) and os.path.exists(output_path)
+            and os.path.getmtime(output_path) >= os.path.getmtime(file_path)):
+        return output_path
+
+    for read_encoding in [encoding, 'cp1252', 'latin-1']:
+        f_out = tempfile.NamedTemporaryFile('w', dir=output_folder or '.', suffix='.tmp', newline='',
+                                            encoding='utf-8', delete=False)
+        try:
+            with open(file_path, newline='', encoding=read_encoding) as f_in, f_out:
+                csv.writer(f_out, lineterminator='\n').writerows(csv.reader(f_in, dialect))
+            os.replace(f_out.name, output_path)
+            return output_path
+        except UnicodeDecodeError:
+            continue
+        finally:
+            if os.path.exists(f_out.name):
+                os.remove(f_out.name)
+
+def normalize_consumption(folder_path, file_pattern="*.csv", output_folder='Transformed\\NormalizedData\\', sample_bytes=65536, workers=None):
+    """
+    Normalize consumption files to comma separated UTF-8 csv in parallel, skipping canonical files
+    and files whose normalized copy is newer than the input
+    :param folder_path: folder path for lookup
+    :param file_pattern: file pattern for lookup
+    :param output folder: output folder to save normalized files
+    :param sample_bytes: number of bytes used to detect encoding and dialect
+    :param workers: number of worker processes, None for cpu count
+    :return: dictionary with file name as key and normalized file path as value
+    """
+    file_dict = fh.get_file_dict(folder_path, file_pattern)
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    names = list(file_dict.keys())
+    paths = [file_dict[name] for name in names]
+    if workers == 1 or len(paths) <= 1:
+        results = [_transform_to_csv(path, output_folder, sample_bytes) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_transform_to_csv, paths, [output_folder] * len(paths), [sample_bytes] * len(paths)))
+    return dict(zip(names, results))
 
 def transform_nmi_master(file_path, output_folder):
     """
@@ -58,70 +154,284 @@ def transform_nmi_master(file_path, output_folder):
     return df
 
 
-def transform_consumption(folder_path, file_pattern = "*.csv", output_folder='Transformed\\ConsumptionData\\', lookup_file='Transformed\\transformed_nmi_info.csv'):
+def transform_consumption(folder_path, file_pattern = "*.csv", output_folder='Transformed\\ConsumptionData\\', lookup_file='Transformed\\transformed_nmi_info.csv', star_schema=False, calendar_freq=None, normalized_folder=None, catalog_db=None, database=None):
     """
     Transform consumption data based on requirement
     :param folder_path: folder path for lookup (must be .csv files under folder path)
     :param file_pattern: file pattern for lookup
     :param output folder: output folder to savae transformed files
+    :param star_schema: keep only CALENDAR_KEY on each row and write date features to calendar_dim.csv once
+    :param calendar_freq: calendar dimension frequency, by default the greatest common divisor of the NMI intervals in the master file and the 30 minute SA offset
+    :param normalized_folder: if set, normalize input files to comma separated UTF-8 in this folder first
+    :param catalog_db: if set, upsert statistics of each transformed NMI into the nmi_stats table of this database
+    :param database: if set, load consumption (and calendar in star schema) tables into this database
     :return: transformed merged dataframe and transformed csv file for each input csv file
     """
-    consumption_dict = dvh.get_file_dict(folder_path, file_pattern)
+    consumption_dict, source_dict = _get_consumption_dict(folder_path, file_pattern, normalized_folder)
+    nmi_dict = fh.get_nmi_dict(lookup_file)
     merged_df = pd.DataFrame()
+    start_time = None
+    end_time = None
     
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
     for name, path in consumption_dict.items():
-        if _lookup_nmi(name, lookup_file):
-                # 2.2 Column type needs to be standardized (i.e., AESTIME same date format)
-                df = pd.read_csv(path, parse_dates=[0])
-                df.columns.name = name
-                
-                # 2.1 Column names need to be standardized (i.e., all uppercase)
-                df.columns = [column.upper() for column in df.columns]
-                
-                # 2.3 Columns values need to be standardized (i.e., UNIT all uppercase)
-                idx = (df.applymap(type) == str).all(0)
-                str_list = df[df.columns[idx]].columns.to_list()
-                for column in str_list:
-                    df[column] = df[column].str.upper()
-                
-                # 2.4 Make sure no duplicate rows
-                df.drop_duplicates(keep=False, inplace=True)
-                df.drop_duplicates(subset = ['AESTTIME'], keep=False, inplace=True)
-                
-                # 2.5 Missing data imputation
-                df = _missing_data_imputation(df)
-                
-                # 2.6 Unit measurement needs to be standardized format (i.e., all KWH)
-                df['QUANTITY'] = np.where(df['UNIT'] == 'MWH', df['QUANTITY'] * 1000.00, df['QUANTITY'])
-                df['QUANTITY'] = np.where(df['UNIT'] == 'WH', df['QUANTITY'] / 1000.00, df['QUANTITY'])
-                df['UNIT'] = np.where(df['UNIT'] == 'MWH', 'KWH', 'KWH')
-                df['UNIT'] = np.where(df['UNIT'] == 'WH', 'KWH', 'KWH')     
-                
-                # 2.7 Transform the datetime column to be local time
-                df = _transform_to_local_time(df, 'AESTTIME', name, lookup_file)
-                
-                # 2.8 Add more date features
-                df = _get_date_features(df, 'TRANSFORMED_AESTTIME')
-                
-                # 2.9 Add NMI column when load consumption data
-                df['NMI'] = name
-                
-                # 2.10 Mark outlier before further analysis
-                Q1 = df['QUANTITY'].quantile(0.25)
-                Q3 = df['QUANTITY'].quantile(0.75)
-                IQR = Q3 - Q1
-                lower_lim = Q1 - 1.5 * IQR
-                upper_lim = Q3 + 1.5 * IQR
-                df['OUTLIER'] = np.where((df['QUANTITY'] < lower_lim) | (df['QUANTITY'] > upper_lim),1,0)
+        if _lookup_nmi(name, nmi_dict):
+                df = _transform_nmi(name, path, nmi_dict, star_schema)
+                if catalog_db is not None:
+                    dh.upsert_dataframe(dh.get_connection(catalog_db), _get_nmi_stats(df, name, source_dict[name]), table='nmi_stats', key_columns=['NMI'])
+                if star_schema:
+                    local_time = df['TRANSFORMED_AESTTIME']
+                    start_time = local_time.min() if start_time is None else min(start_time, local_time.min())
+                    end_time = local_time.max() if end_time is None else max(end_time, local_time.max())
                 
                 df.to_csv(output_folder + f'transformed_{name}.csv', index=None)
                 merged_df = merged_df.append(df)
     
     merged_df.to_csv(output_folder + f'transformed_consumption_data_merged.csv', index=None)
+    calendar_df = None
+    if star_schema and start_time is not None:
+        calendar_df = build_calendar_dim(start_time, end_time, calendar_freq or _get_calendar_freq(merged_df['NMI'].unique(), lookup_file))
+        calendar_df.to_csv(output_folder + f'calendar_dim.csv', index=None)
+    if database is not None and len(merged_df) > 0:
+        conn = dh.create_connection(database)
+        merged_df.to_sql('consumption', conn, if_exists='replace', index=False)
+        if calendar_df is not None:
+            calendar_df.to_sql('calendar', conn, if_exists='replace', index=False)
+        dh.create_indexes(conn)
+        conn.close()
     return merged_df
 
+def transform_consumption_out_of_core(folder_path, file_pattern = "*.csv", output_folder='Transformed\\ConsumptionData\\', lookup_file='Transformed\\transformed_nmi_info.csv', staging_db='Transformed\\staging.db', memory_budget_mb=512, star_schema=False, calendar_freq=None, normalized_folder=None, database=None, catalog_db=None):
+    """
+    Transform consumption data like transform_consumption, but spill each transformed NMI
+    to a SQLite staging database and run merge, hourly aggregation and load as chunked steps,
+    so memory does not grow with the number of NMIs. Each NMI is still transformed whole in
+    pandas, so peak memory is the largest single NMI plus memory_budget_mb; the budget is not
+    enforced on a single NMI
+    :param folder_path: folder path for lookup (must be .csv files under folder path)
+    :param file_pattern: file pattern for lookup
+    :param output folder: output folder to savae transformed files
+    :param lookup_file: nmi master file to get state info
+    :param staging_db: SQLite staging database file, its tables are rebuilt on every run
+    :param memory_budget_mb: memory budget in MB for write and export chunks and the SQLite page cache
+    :param star_schema: keep only CALENDAR_KEY on each row and write the calendar table once
+    :param calendar_freq: calendar dimension frequency, by default the greatest common divisor of the NMI intervals in the master file and the 30 minute SA offset
+    :param normalized_folder: if set, normalize input files to comma separated UTF-8 in this folder first
+    :param database: if set, copy consumption, hourly_consumption (and calendar) tables to this database
+    :param catalog_db: if set, upsert statistics of each transformed NMI into the nmi_stats table of this database
+    :return: staging database file with consumption and hourly_consumption tables
+    """
+    consumption_dict, source_dict = _get_consumption_dict(folder_path, file_pattern, normalized_folder)
+    nmi_dict = fh.get_nmi_dict(lookup_file)
+    start_time = None
+    end_time = None
+    chunksize = None
+    nmi_list = []
+    tables = ['consumption', 'hourly_consumption']
+    
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    conn = dh.create_connection(staging_db)
+    dh.set_memory_budget(conn, memory_budget_mb)
+    for table in tables + ['calendar']:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    
+    for name, path in consumption_dict.items():
+        if _lookup_nmi(name, nmi_dict):
+                df = _transform_nmi(name, path, nmi_dict, star_schema)
+                if catalog_db is not None:
+                    dh.upsert_dataframe(dh.get_connection(catalog_db), _get_nmi_stats(df, name, source_dict[name]), table='nmi_stats', key_columns=['NMI'])
+                if star_schema:
+                    local_time = df['TRANSFORMED_AESTTIME']
+                    start_time = local_time.min() if start_time is None else min(start_time, local_time.min())
+                    end_time = local_time.max() if end_time is None else max(end_time, local_time.max())
+                # size chunks from each NMI, the export uses the smallest so wide rows fit too
+                nmi_chunksize = _get_chunksize(df, memory_budget_mb)
+                chunksize = nmi_chunksize if chunksize is None else min(chunksize, nmi_chunksize)
+                nmi_list.append(name)
+                
+                df.to_csv(output_folder + f'transformed_{name}.csv', index=None)
+                df.to_sql('consumption', conn, if_exists='append', index=False, chunksize=nmi_chunksize)
+                del df
+    
+    if star_schema and start_time is not None:
+        calendar_df = build_calendar_dim(start_time, end_time, calendar_freq or _get_calendar_freq(nmi_list, lookup_file))
+        calendar_df.to_csv(output_folder + f'calendar_dim.csv', index=None)
+        calendar_df.to_sql('calendar', conn, if_exists='replace', index=False)
+        tables.append('calendar')
+    if chunksize is not None:
+        dh.create_indexes(conn)
+        dh.export_query(conn, "SELECT * FROM consumption", output_folder + f'transformed_consumption_data_merged.csv', chunksize=chunksize)
+        dh.aggregate_hourly(conn)
+    conn.close()
+    
+    if database is not None and chunksize is not None:
+        dh.copy_tables(staging_db, database, tables)
+    return staging_db
+
+def _get_consumption_dict(folder_path, file_pattern, normalized_folder):
+    """
+    Get consumption files to transform, normalized first if normalized_folder is set
+    :param folder_path: folder path for lookup
+    :param file_pattern: file pattern for lookup
+    :param normalized_folder: folder to save normalized files, or None
+    :return: dictionary with file name as key and file path to read as value,
+             and dictionary with file name as key and original source path as value
+    """
+    source_dict = fh.get_file_dict(folder_path, file_pattern)
+    if normalized_folder is None:
+        return source_dict, source_dict
+    return normalize_consumption(folder_path, file_pattern, normalized_folder), source_dict
+
+def _get_nmi_stats(df, name, path):
+    """
+    Get catalog statistics of a transformed NMI
+    :param df: transformed dataframe of the nmi
+    :param name: nmi name
+    :param path: original source file path of the nmi (not the normalized copy)
+    :return: single row dataframe with nmi statistics
+    """
+    steps = df['AESTTIME'].sort_values().diff().dropna()
+    interval = steps.mode().iloc[0] if len(steps) > 0 else pd.NaT
+    gaps = steps[steps > interval] if len(steps) > 0 else steps
+    quantity = df['QUANTITY']
+    stat = os.stat(path)
+    return pd.DataFrame([{'NMI': name,
+                          'STATE': df['STATE'].iloc[0] if len(df) > 0 else None,
+                          'ROWS': len(df),
+                          'FIRST_LOCALTIME': str(df['TRANSFORMED_AESTTIME'].min()),
+                          'LAST_LOCALTIME': str(df['TRANSFORMED_AESTTIME'].max()),
+                          'INTERVAL': interval / pd.Timedelta(minutes=1) if len(steps) > 0 else None,
+                          'QUANTITY_MIN': quantity.min(),
+                          'QUANTITY_Q25': quantity.quantile(0.25),
+                          'QUANTITY_MEDIAN': quantity.quantile(0.5),
+                          'QUANTITY_Q75': quantity.quantile(0.75),
+                          'QUANTITY_MAX': quantity.max(),
+                          'QUANTITY_MEAN': quantity.mean(),
+                          'OUTLIERS': int(df['OUTLIER'].sum()),
+                          'GAPS': len(gaps),
+                          'MISSING_INTERVALS': int((gaps / interval - 1).sum()) if len(gaps) > 0 else 0,
+                          'SOURCE_PATH': path,
+                          'SOURCE_SIZE': stat.st_size,
+                          'SOURCE_MTIME': stat.st_mtime,
+                          'UPDATED_AT': str(pd.Timestamp.now().floor('s'))}])
+
+def _get_chunksize(df, memory_budget_mb):
+    """
+    Get number of rows per chunk that fits the memory budget, based on a sample dataframe
+    :param df: sample dataframe
+    :param memory_budget_mb: memory budget in MB
+    :return: number of rows per chunk
+    """
+    row_bytes = df.memory_usage(deep=True).sum() / max(len(df), 1)
+    # leave room for the copies made while converting a chunk for csv or SQLite
+    return max(1000, int(memory_budget_mb * 1024 * 1024 / (row_bytes * 4)))
+
+def _transform_nmi(name, path, nmi_dict, star_schema=False):
+    """
+    Transform consumption data of a single NMI based on requirement
+    :param name: nmi name
+    :param path: consumption file path of the nmi
+    :param nmi_dict: dictionary with nmi as key and state as value from the master file
+    :param star_schema: add CALENDAR_KEY instead of date features
+    :return: transformed dataframe
+    """
+    # 2.2 Column type needs to be standardized (i.e., AESTIME same date format)
+    df = pd.read_csv(path, parse_dates=[0])
+    df.columns.name = name
+    
+    # 2.1 Column names need to be standardized (i.e., all uppercase)
+    df.columns = [column.upper() for column in df.columns]
+    
+    # 2.3 Columns values need to be standardized (i.e., UNIT all uppercase)
+    idx = (df.applymap(type) == str).all(0)
+    str_list = df[df.columns[idx]].columns.to_list()
+    for column in str_list:
+        df[column] = df[column].str.upper()
+    
+    # 2.4 Make sure no duplicate rows
+    df.drop_duplicates(keep=False, inplace=True)
+    df.drop_duplicates(subset = ['AESTTIME'], keep=False, inplace=True)
+    
+    # 2.5 Missing data imputation
+    df = _missing_data_imputation(df)
+    
+    # 2.6 Unit measurement needs to be standardized format (i.e., all KWH)
+    df['QUANTITY'] = np.where(df['UNIT'] == 'MWH', df['QUANTITY'] * 1000.00, df['QUANTITY'])
+    df['QUANTITY'] = np.where(df['UNIT'] == 'WH', df['QUANTITY'] / 1000.00, df['QUANTITY'])
+    df['UNIT'] = np.where(df['UNIT'] == 'MWH', 'KWH', 'KWH')
+    df['UNIT'] = np.where(df['UNIT'] == 'WH', 'KWH', 'KWH')     
+    
+    # 2.7 Transform the datetime column to be local time
+    df = _transform_to_local_time(df, 'AESTTIME', name, nmi_dict)
+    
+    # 2.8 Add more date features
+    if star_schema:
+        df = _get_calendar_key(df, 'TRANSFORMED_AESTTIME')
+    else:
+        df = _get_date_features(df, 'TRANSFORMED_AESTTIME')
+    
+    # 2.9 Add NMI column when load consumption data
+    df['NMI'] = name
+    
+    # 2.10 Mark outlier before further analysis
+    df['OUTLIER'] = _mark_outlier(df['QUANTITY'])
+    return df
+
+def _mark_outlier(series):
+    """
+    Mark values outside 1.5 IQR of the quartiles as outliers
+    :param series: input series
+    :return: array with 1 for outlier and 0 otherwise
+    """
+    Q1, Q3 = series.quantile([0.25, 0.75])
+    IQR = Q3 - Q1
+    lower_lim = Q1 - 1.5 * IQR
+    upper_lim = Q3 + 1.5 * IQR
+    return np.where((series < lower_lim) | (series > upper_lim),1,0)
+
+def build_calendar_dim(start_time, end_time, freq='15T'):
+    """
+    Build calendar dimension with date features for every local timestamp in range,
+    fact rows join on CALENDAR_KEY
+    :param start_time: first local timestamp
+    :param end_time: last local timestamp
+    :param freq: calendar frequency
+    :return: calendar dataframe keyed by CALENDAR_KEY
+    """
+    start_time = pd.Timestamp(start_time).floor(freq)
+    df = pd.DataFrame({'TRANSFORMED_AESTTIME': pd.date_range(start_time, end_time, freq=freq)})
+    df = _get_date_features(df, 'TRANSFORMED_AESTTIME')
+    df = _get_calendar_key(df, 'TRANSFORMED_AESTTIME')
+    df = df.rename(columns={'TRANSFORMED_AESTTIME': 'LOCALTIME'})
+    return df[['CALENDAR_KEY'] + [column for column in df.columns if column != 'CALENDAR_KEY']]
+
+def _get_calendar_freq(nmi_list, lookup_file):
+    """
+    Get calendar frequency that matches every NMI interval in the master file
+    and the local time offset of every state, so each CALENDAR_KEY is in the calendar
+    :param nmi_list: transformed nmis
+    :param lookup_file: the look up file to get interval info
+    :return: frequency string in minutes
+    """
+    interval_dict = fh.get_nmi_dict(lookup_file, value_column='INTERVAL')
+    return f"{math.gcd(LOCAL_OFFSET_MINUTES, *[int(float(interval_dict[nmi])) for nmi in nmi_list])}T"
+
+def _get_calendar_key(df, date_column):
+    """
+    Drop timezone from local datetime column and add CALENDAR_KEY as YYYYMMDDHHMM
+    :param df: input dateframe
+    :param date_column: datatime column for lookup
+    :return: transformed dataframe
+    """
+    if df[date_column].dt.tz is not None:
+        df[date_column] = df[date_column].dt.tz_localize(None)
+    local_time = df[date_column].dt
+    df['CALENDAR_KEY'] = (local_time.year.astype('int64') * 100000000 + local_time.month * 1000000
+                          + local_time.day * 10000 + local_time.hour * 100 + local_time.minute)
+    return df
+
 def _missing_data_imputation(df):
     """
     Apply different strategies to deal with missing data
@@ -187,46 +497,31 @@ def _get_season(df):
     else:
         return 4 #'Winter' 
            
-def _transform_to_local_time(df, date_column, lookup_nmi, lookup_file):
+def _transform_to_local_time(df, date_column, lookup_nmi, nmi_dict):
     """
     Transform AEST Datetime to be local time based on state in the master file
     :param df: input dateframe
     :param date_column: datatime column for lookup
     :param lookup_nmi: lookup nmi 
-    :param lookup_file: the look up file to get state info
+    :param nmi_dict: dictionary with nmi as key and state as value from the master file
     :return: tranformed dataframe
     """
     df[date_column] = pd.to_datetime(df[date_column])
-    lookup_df = pd.read_csv(lookup_file)
-    state = lookup_df[lookup_df['NMI'] == lookup_nmi]['STATE'].to_list()[0]
-    
-    default_timezone = 'Australia/Brisbane'
-    transform_dict = {'VIC': 'Australia/Victoria',
-                      'NSW': 'Australia/NSW',
-                      'SA': 'Australia/Adelaide',
-                      'WA': 'Australia/West',
-                      'TAS':'Australia/Tasmania',
-                      'QLD': 'Australia/Queensland',
-                      'ACT': 'Australia/ACT'}
+    state = nmi_dict[lookup_nmi]
     
     df['STATE'] = state
     transformed_column = f'TRANSFORMED_{date_column}'
-    df[transformed_column] = df[date_column].dt.tz_localize(default_timezone).dt.tz_convert(transform_dict[state])
+    df[transformed_column] = df[date_column].dt.tz_localize(DEFAULT_TIMEZONE).dt.tz_convert(TIMEZONE_DICT[state])
     return df
 
-def _lookup_nmi(lookup_nmi, lookup_file):
+def _lookup_nmi(lookup_nmi, nmi_dict):
     """
     Check nmi in the master file or not
     :param lookup_nmi: lookup nmi
-    :param lookup_file: the look up file to get nmi info
-    :return: tranformed dataframe
+    :param nmi_dict: dictionary with nmi as key from the master file
+    :return: True if nmi is in the master file
     """
-    df = pd.read_csv(lookup_file)
-    lookup_list = df['NMI'].values.tolist()
-    if lookup_nmi in lookup_list:
-        return True
-    else:
-        return False
+    return lookup_nmi in nmi_dict
     
 def _combine_load_data(file_dict):
     """
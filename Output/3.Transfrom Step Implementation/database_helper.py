@@ -3,8 +3,50 @@
 # This module is built to setup consumption SQLlite database
 
 import sqlite3
-from sqlite3 import Error
+from sqlite3 import Error, IntegrityError
 import os
+from datetime import time
+
+_connections = {}
+
+# hourly report for star schema output, joins interval rows to the calendar dimension
+SQL_STAR_HOURLY_REPORT = """
+SELECT
+c.NMI,
+d.YEAR,
+d.MONTH,
+d.DAY,
+d.HOUR,
+c.STATE,
+CASE
+WHEN d.SESSION = 1 THEN 'Late Night'
+WHEN d.SESSION = 2 THEN 'Early Morning'
+WHEN d.SESSION = 3 THEN 'Morning'
+WHEN d.SESSION = 4 THEN 'Noon'
+WHEN d.SESSION = 5 THEN 'Eve'
+ELSE 'Night' END AS SESSION,
+
+CASE
+WHEN d.SEASON = 1 THEN 'Spring'
+WHEN d.SEASON = 2 THEN 'Summer'
+WHEN d.SEASON = 3 THEN 'Autumn'
+ELSE 'Winter' END AS SEASON,
+
+SUM(c.QUANTITY) AS TOTAL_CONSUMPTION
+
+FROM consumption c
+JOIN calendar d ON d.CALENDAR_KEY = c.CALENDAR_KEY
+GROUP BY
+c.NMI,
+d.YEAR,
+d.MONTH,
+d.DAY,
+d.HOUR,
+c.STATE,
+d.SESSION,
+d.SEASON
+ORDER BY c.NMI
+"""
 
 def create_connection(db_file):
     """ create a database connection to the SQLite database
@@ -19,4 +61,378 @@ def create_connection(db_file):
     except Error as e:
         print(e)
 
-    return conn
\ No newline at end of file
+    return conn
+
+def get_connection(db_file):
+    """ get a shared database connection to the SQLite database
+        specified by db_file, creating it on first use
+    :param db_file: database file
+    :return: Connection object or None
+    """
+    key = os.path.abspath(db_file)
+    conn = _connections.get(key)
+    if conn is None:
+        conn = create_connection(db_file)
+        if conn is not None:
+            _connections[key] = conn
+    return conn
+
+def close_connection(db_file=None):
+    """ close the shared connection to db_file, or all shared
+        connections when db_file is None
+    :param db_file: database file
+    """
+    if db_file is None:
+        keys = list(_connections)
+    else:
+        keys = [os.path.abspath(db_file)]
+    for key in keys:
+        conn = _connections.pop(key, None)
+        if conn is not None:
+            conn.close()
+
+def _ensure_index(conn, name, table, columns, unique=False):
+    """ create an index on table columns unless one already covers
+        exactly these columns, upgrading a non-unique one if unique.
+        The existing index is kept if the table has duplicate keys
+    :param conn: Connection object
+    :param name: index name
+    :param table: table name
+    :param columns: indexed column list
+    :param unique: create a UNIQUE index
+    :raise IntegrityError: unique is set and the table repeats a key
+    """
+    for _, index_name, index_unique, origin, _ in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        index_columns = [row[2] for row in conn.execute(f"PRAGMA index_info('{index_name}')").fetchall()]
+        if index_columns == columns:
+            if index_unique or not unique:
+                return
+            if origin == 'c':
+                column_list = ", ".join(columns)
+                duplicate = conn.execute(f"SELECT {column_list} FROM {table} GROUP BY {column_list} "
+                                         f"HAVING COUNT(*) > 1 LIMIT 1").fetchone()
+                if duplicate is not None:
+                    raise IntegrityError(f"cannot create unique index {name}: {table} repeats key {duplicate}")
+                conn.execute(f"DROP INDEX {index_name}")
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    conn.execute(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+def create_indexes(conn):
+    """ create the indexes used by report queries on the
+        consumption, nmi and calendar tables, skipping tables
+        or columns that do not exist. (NMI, AESTTIME) is unique
+        and is the conflict target of upsert_dataframe
+    :param conn: Connection object
+    """
+    index_list = [("idx_consumption_nmi_time", "consumption", ["NMI", "AESTTIME"], True),
+                  ("idx_consumption_state_time", "consumption", ["STATE", "AESTTIME"], False),
+                  ("idx_consumption_calendar", "consumption", ["CALENDAR_KEY"], False),
+                  ("idx_nmi_nmi", "nmi", ["NMI"], False),
+                  ("idx_calendar_key", "calendar", ["CALENDAR_KEY"], False)]
+    for name, table, columns, unique in index_list:
+        try:
+            table_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            if all(column in table_columns for column in columns):
+                _ensure_index(conn, name, table, columns, unique)
+            conn.commit()
+        except Error as e:
+            print(e)
+
+def set_memory_budget(conn, memory_budget_mb):
+    """ limit the SQLite page cache to a quarter of the memory
+        budget and spill sorts and temp tables to disk
+    :param conn: Connection object
+    :param memory_budget_mb: memory budget in MB
+    """
+    cache_kib = max(2048, int(memory_budget_mb * 1024 / 4))
+    try:
+        conn.execute(f"PRAGMA cache_size = -{cache_kib}")
+        conn.execute("PRAGMA temp_store = FILE")
+    except Error as e:
+        print(e)
+
+def aggregate_hourly(conn, source="consumption", target="hourly_consumption"):
+    """ rebuild the hourly consumption table per NMI and local hour
+        inside SQLite, without loading rows into memory
+    :param conn: Connection object
+    :param source: interval consumption table
+    :param target: hourly consumption table
+    """
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({source})")]
+    calendar_key = ", MIN(CALENDAR_KEY / 100 * 100) AS CALENDAR_KEY" if "CALENDAR_KEY" in columns else ""
+    sql = f"""CREATE TABLE {target} AS
+              SELECT NMI, STATE, substr(TRANSFORMED_AESTTIME, 1, 13) || ':00:00' AS HOUR_START{calendar_key},
+                     SUM(QUANTITY) AS TOTAL_CONSUMPTION, COUNT(*) AS INTERVALS
+              FROM {source}
+              GROUP BY NMI, STATE, HOUR_START"""
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS {target}")
+        conn.execute(sql)
+        conn.commit()
+    except Error as e:
+        print(e)
+
+def copy_tables(source_db, target_db, tables):
+    """ replace tables in target_db with the tables of source_db,
+        copied inside SQLite without loading rows into memory,
+        then rebuild the report indexes on target_db since
+        CREATE TABLE AS does not copy indexes
+    :param source_db: source database file
+    :param target_db: target database file
+    :param tables: list of table names to copy
+    """
+    conn = create_connection(source_db)
+    try:
+        conn.execute("ATTACH DATABASE ? AS target", (target_db,))
+        for table in tables:
+            conn.execute(f"DROP TABLE IF EXISTS target.{table}")
+            conn.execute(f"CREATE TABLE target.{table} AS SELECT * FROM main.{table}")
+        conn.commit()
+        conn.execute("DETACH DATABASE target")
+    except Error as e:
+        print(e)
+    finally:
+        conn.close()
+    conn = create_connection(target_db)
+    create_indexes(conn)
+    conn.close()
+
+def build_filters(nmi_list=None, start_date=None, end_date=None, state=None, date_column='AESTTIME'):
+    """ build a parameterized WHERE clause for consumption queries
+    :param nmi_list: list of NMIs to keep
+    :param start_date: keep rows at or after this datetime
+    :param end_date: keep rows before this datetime
+    :param state: STATE value or list of STATE values to keep
+    :param date_column: datetime column for the date range
+    :return: WHERE clause (empty string if no filter) and parameter list
+    """
+    conditions = []
+    params = []
+    if nmi_list is not None:
+        nmi_list = list(nmi_list)
+        conditions.append(f"NMI IN ({', '.join('?' * len(nmi_list))})")
+        params.extend(nmi_list)
+    if start_date is not None:
+        conditions.append(f"{date_column} >= ?")
+        params.append(str(start_date))
+    if end_date is not None:
+        conditions.append(f"{date_column} < ?")
+        params.append(str(end_date))
+    if state is not None:
+        state_list = [state] if isinstance(state, str) else list(state)
+        conditions.append(f"STATE IN ({', '.join('?' * len(state_list))})")
+        params.extend(state_list)
+    if len(conditions) == 0:
+        return "", params
+    return "WHERE " + " AND ".join(conditions), params
+
+def select_consumption(columns="*", table="consumption", **filters):
+    """ build a parameterized SELECT query on the consumption table
+    :param columns: column list or string to select
+    :param table: table to select from
+    :param filters: keyword filters passed to build_filters
+    :return: SQL query and parameter list
+    """
+    if not isinstance(columns, str):
+        columns = ", ".join(columns)
+    where, params = build_filters(**filters)
+    return f"SELECT {columns} FROM {table} {where}".strip(), params
+
+def query_chunks(conn, sql, params=None, chunksize=50000):
+    """ run a query and stream the result as dataframe chunks
+    :param conn: Connection object
+    :param sql: SQL query with ? placeholders
+    :param params: query parameter list
+    :param chunksize: number of rows in each chunk
+    :return: generator of dataframes
+    """
+    import pandas as pd
+    return pd.read_sql_query(sql, conn, params=params, chunksize=chunksize)
+
+def _get_arrow_type(conn, sql, params, column, index, values):
+    """ get the Arrow type of a query column from its first non-null
+        value, probing the query when the first batch is all null
+    :param conn: Connection object
+    :param sql: SQL query with ? placeholders
+    :param params: query parameter list
+    :param column: column name
+    :param index: column position
+    :param values: column values of the first batch
+    :return: pyarrow DataType
+    """
+    import pyarrow as pa
+    value = next((value for value in values if value is not None), None)
+    if value is None:
+        row = conn.execute(f'SELECT * FROM ({sql}) WHERE "{column}" IS NOT NULL LIMIT 1', params).fetchone()
+        value = None if row is None else row[index]
+    if value is None:
+        return pa.null()
+    return pa.array([value]).type
+
+def query_arrow_batches(conn, sql, params=None, batch_size=50000, schema=None):
+    """ run a query and stream the result as Arrow record batches,
+        every batch has the same schema
+    :param conn: Connection object
+    :param sql: SQL query with ? placeholders
+    :param params: query parameter list
+    :param batch_size: number of rows in each batch
+    :param schema: pyarrow Schema, inferred from the first non-null value of each column if None
+    :return: generator of pyarrow RecordBatch
+    """
+    import pyarrow as pa
+    params = params or []
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    names = [column[0] for column in cur.description]
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        if schema is None:
+            schema = pa.schema([(name, _get_arrow_type(conn, sql, params, name, i, columns[i]))
+                                for i, name in enumerate(names)])
+        arrays = [pa.array(values, type=schema.field(i).type) for i, values in enumerate(columns)]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+    cur.close()
+
+def export_query(conn, sql, output_file, params=None, chunksize=50000):
+    """ export a query result to csv chunk by chunk in constant memory
+    :param conn: Connection object
+    :param sql: SQL query with ? placeholders
+    :param output_file: output csv file
+    :param params: query parameter list
+    :param chunksize: number of rows in each chunk
+    :return: number of exported rows
+    """
+    total = 0
+    header = True
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    for chunk in query_chunks(conn, sql, params, chunksize):
+        chunk.to_csv(output_file, mode='a', header=header, index=False)
+        header = False
+        total += len(chunk)
+    return total
+
+def get_nmi_stats(conn, nmi_list=None, state=None, gaps_only=False):
+    """ query the per NMI statistics catalog written by
+        data_transform_helper without scanning consumption data
+    :param conn: Connection object
+    :param nmi_list: list of NMIs to keep
+    :param state: STATE value or list of STATE values to keep
+    :param gaps_only: keep only NMIs with gaps
+    :return: list of dictionaries, one per NMI
+    """
+    where, params = build_filters(nmi_list=nmi_list, state=state)
+    if gaps_only:
+        where = (where + " AND " if where else "WHERE ") + "GAPS > 0"
+    result = []
+    try:
+        cur = conn.execute(f"SELECT * FROM nmi_stats {where} ORDER BY NMI", params)
+        names = [column[0] for column in cur.description]
+        result = [dict(zip(names, row)) for row in cur.fetchall()]
+    except Error as e:
+        print(e)
+    return result
+
+def get_stale_nmis(conn, file_dict):
+    """ find NMIs whose source file is new or changed since the
+        statistics catalog was updated, comparing size and mtime only
+    :param conn: Connection object
+    :param file_dict: dictionary with file name as key and file path as value
+    :return: list of NMIs that need to be transformed again
+    """
+    catalog = {row["NMI"]: (row["SOURCE_SIZE"], row["SOURCE_MTIME"]) for row in get_nmi_stats(conn)}
+    result = []
+    for name, path in file_dict.items():
+        stat = os.stat(path)
+        if catalog.get(name) != (stat.st_size, stat.st_mtime):
+            result.append(name)
+    return result
+
+def _get_sql_values(df):
+    """ convert dataframe rows to sqlite3 parameters, with values
+        written the same way as DataFrame.to_sql so unchanged rows
+        compare equal to rows loaded by to_sql
+    :param df: input dataframe
+    :return: list of row tuples
+    """
+    import pandas as pd
+    columns = []
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values = [None if pd.isnull(value) else str(value) for value in series.dt.to_pydatetime()]
+        else:
+            values = [None if pd.isnull(value) else value for value in series.astype(object)]
+            values = [value.strftime("%H:%M:%S.%f") if isinstance(value, time)
+                      else value.item() if hasattr(value, "item") else value for value in values]
+        columns.append(values)
+    return list(zip(*columns))
+
+def upsert_dataframe(conn, df, table="consumption", key_columns=["NMI", "AESTTIME"], batch_size=50000):
+    """ upsert dataframe rows into table on key_columns with
+        INSERT ... ON CONFLICT DO UPDATE, one transaction per batch,
+        so load time scales with the delta and not the table.
+        Rows repeating a key keep the last one. Each batch commits on
+        its own; if a batch fails it is rolled back and the counts
+        cover the committed batches only. Raises if table already
+        repeats a key, since the conflict target needs a unique index
+    :param conn: Connection object
+    :param df: dataframe with the same columns as table
+    :param table: target table, created if it does not exist
+    :param key_columns: primary key columns
+    :param batch_size: number of rows in each transaction
+    :return: dictionary with inserted, updated and unchanged row counts
+    :raise IntegrityError: table repeats a key, so no unique index can be created
+    """
+    staging = f"_{table}_staging"
+    df = df.drop_duplicates(subset=key_columns, keep='last')
+    columns = df.columns.to_list()
+    value_columns = [column for column in columns if column not in key_columns]
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    key_list = ", ".join(f'"{column}"' for column in key_columns)
+    update_list = ", ".join(f'"{column}" = excluded."{column}"' for column in value_columns)
+    changed = " OR ".join(f'{table}."{column}" IS NOT excluded."{column}"' for column in value_columns)
+    join_list = " AND ".join(f's."{column}" = t."{column}"' for column in key_columns)
+
+    if value_columns:
+        conflict_sql = f"DO UPDATE SET {update_list} WHERE {changed}"
+    else:
+        conflict_sql = "DO NOTHING"
+    upsert_sql = (f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} WHERE true "
+                  f"ON CONFLICT ({key_list}) {conflict_sql}")
+    existing_sql = f"SELECT COUNT(*) FROM {staging} s JOIN {table} t ON {join_list}"
+    insert_sql = f"INSERT INTO {staging} ({column_list}) VALUES ({', '.join('?' * len(columns))})"
+
+    result = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if conn is None:
+        return result
+    # the conflict target needs a unique index on the key columns
+    df.head(0).to_sql(table, conn, if_exists='append', index=False)
+    _ensure_index(conn, f"idx_{table}_key", table, key_columns, unique=True)
+    try:
+        # a temp table copies the column affinities of table, so values compare as stored
+        conn.execute(f"DROP TABLE IF EXISTS temp.{staging}")
+        conn.execute(f"CREATE TEMP TABLE {staging} AS SELECT {column_list} FROM {table} WHERE 0")
+        conn.commit()
+        for start in range(0, len(df), batch_size):
+            batch = df.iloc[start:start + batch_size]
+            with conn:
+                conn.execute(f"DELETE FROM {staging}")
+                conn.executemany(insert_sql, _get_sql_values(batch))
+                existing = conn.execute(existing_sql).fetchone()[0]
+                before = conn.total_changes
+                conn.execute(upsert_sql)
+                changes = conn.total_changes - before
+            inserted = len(batch) - existing
+            result["inserted"] += inserted
+            result["updated"] += changes - inserted
+            result["unchanged"] += existing - (changes - inserted)
+    except Error as e:
+        print(e)
+    finally:
+        conn.execute(f"DROP TABLE IF EXISTS temp.{staging}")
+        conn.commit()
+    return result
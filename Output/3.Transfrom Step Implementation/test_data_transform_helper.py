@@ -3,7 +3,12 @@
 # This module is built to do unit test for data transformation job
 
 import data_transform_helper as dth
+import database_helper as dh
 import unittest
+import glob
+import os
+import tempfile
+from unittest import mock
 import pandas as pd
 
 class TransformNMITest(unittest.TestCase):
@@ -108,6 +113,234 @@ class TransformConsumptionTest(unittest.TestCase):
         actual = list(result.unique())[0]
         expected = True
         self.assertEqual(actual, expected)
+
+class CalendarDimensionTest(unittest.TestCase):
+    def setUp(self):
+        print("Calendar Dimension Test Data Setup Called...")
+        self.calendar_df = dth.build_calendar_dim('2021-01-01 00:10:00', '2021-01-02 23:30:00', '30T')
+
+    def test_9_unique_key_calendar(self):
+        """
+        Test calendar has one row per key and covers the date range
+        """
+        actual = (self.calendar_df['CALENDAR_KEY'].is_unique, len(self.calendar_df))
+        expected = (True, 96)
+        self.assertEqual(actual, expected)
+
+    def test_10_key_matches_local_time_calendar(self):
+        """
+        Test calendar key is built from local time
+        """
+        actual = self.calendar_df[['CALENDAR_KEY', 'HOUR', 'MINUTE']].iloc[3].tolist()
+        expected = [202101010130, 1, 30]
+        self.assertEqual(actual, expected)
+
+class CalendarFrequencyTest(unittest.TestCase):
+    def setUp(self):
+        print("Calendar Frequency Test Data Setup Called...")
+        self.folder = tempfile.TemporaryDirectory()
+        self.lookup_file = os.path.join(self.folder.name, 'transformed_nmi_info.csv')
+        pd.DataFrame({'NMI': ['NMIA1', 'NMIA2', 'NMIA3', 'NMIA4'], 'STATE': ['NSW', 'VIC', 'QLD', 'SA'],
+                      'INTERVAL': [30, 15, 5, 60]}).to_csv(self.lookup_file, index=None)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_12_calendar_freq_from_master(self):
+        """
+        Test calendar frequency divides every transformed NMI interval
+        """
+        actual = [dth._get_calendar_freq(['NMIA1', 'NMIA2'], self.lookup_file),
+                  dth._get_calendar_freq(['NMIA1', 'NMIA2', 'NMIA3'], self.lookup_file),
+                  dth._get_calendar_freq(['NMIA4'], self.lookup_file)]
+        expected = ['15T', '5T', '30T']
+        self.assertEqual(actual, expected)
+
+class NormalizeTest(unittest.TestCase):
+    def setUp(self):
+        print("Normalize Test Data Setup Called...")
+        self.folder = tempfile.TemporaryDirectory()
+        self.output_folder = os.path.join(self.folder.name, 'Normalized')
+        os.makedirs(self.output_folder)
+        self.content = 'AESTTime,Quantity,Unit\n2021-01-01 00:00:00,1.5,kWh°\n2021-01-01 00:30:00,2.5,kWh°\n'
+        self.canonical = os.path.join(self.folder.name, 'NMIA1.csv')
+        self.vendor = os.path.join(self.folder.name, 'NMIA2.csv')
+        with open(self.canonical, 'w', newline='', encoding='utf-8') as f:
+            f.write(self.content)
+        with open(self.vendor, 'w', newline='', encoding='cp1252') as f:
+            f.write(self.content.replace(',', ';').replace('\n', '\r\n'))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def _read(self, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            return f.read()
+
+    def test_13_detect_encoding(self):
+        """
+        Test encoding detection for BOM, UTF-8 cut inside a character and cp1252
+        """
+        actual = [dth._detect_encoding(b'\xef\xbb\xbfa,b'), dth._detect_encoding('a,°'.encode('utf-8')[:-1]),
+                  dth._detect_encoding('a;°'.encode('cp1252'))]
+        expected = ['utf-8-sig', 'utf-8', 'cp1252']
+        self.assertEqual(actual, expected)
+
+    def test_14_normalize_vendor_file(self):
+        """
+        Test delimiter and encoding are normalized and canonical files are skipped
+        """
+        actual = [dth._transform_to_csv(self.canonical, self.output_folder) == self.canonical,
+                  self._read(dth._transform_to_csv(self.vendor, self.output_folder))]
+        expected = [True, self.content]
+        self.assertEqual(actual, expected)
+
+    def test_15_normalize_up_to_date_and_in_place(self):
+        """
+        Test up to date output is not rewritten and normalizing into the input folder keeps the data
+        """
+        output_path = dth._transform_to_csv(self.vendor, self.output_folder)
+        os.utime(output_path, (0, os.path.getmtime(self.vendor) + 10))
+        mtime = os.path.getmtime(output_path)
+        dth._transform_to_csv(self.vendor, self.output_folder)
+        in_place = dth._transform_to_csv(self.vendor, self.folder.name)
+        actual = [os.path.getmtime(output_path) == mtime, in_place == self.vendor, self._read(self.vendor)]
+        expected = [True, True, self.content]
+        self.assertEqual(actual, expected)
+
+class NMIStatsTest(unittest.TestCase):
+    def setUp(self):
+        print("NMI Stats Test Data Setup Called...")
+        times = pd.date_range('2021-01-01', periods=10, freq='30T').delete([3, 6, 7])
+        self.df = pd.DataFrame({'AESTTIME': times,
+                                'TRANSFORMED_AESTTIME': times + pd.Timedelta(hours=1),
+                                'QUANTITY': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 100.0],
+                                'STATE': 'NSW',
+                                'OUTLIER': [0, 0, 0, 0, 0, 0, 1]})
+        self.stats = dth._get_nmi_stats(self.df, 'NMIA1', __file__).iloc[0]
+
+    def test_11_gaps_nmi_stats(self):
+        """
+        Test catalog counts rows, gaps and missing intervals
+        """
+        actual = [self.stats['ROWS'], self.stats['INTERVAL'], self.stats['GAPS'], self.stats['MISSING_INTERVALS'], self.stats['OUTLIERS']]
+        expected = [7, 30.0, 2, 3, 1]
+        self.assertEqual(actual, expected)
         
+class CatalogTransformTest(unittest.TestCase):
+    def setUp(self):
+        print("Catalog Transform Test Data Setup Called...")
+        self.folder = tempfile.TemporaryDirectory()
+        self.consumption_folder = os.path.join(self.folder.name, 'ConsumptionData')
+        self.output_folder = os.path.join(self.folder.name, 'Transformed') + os.sep
+        self.catalog_db = os.path.join(self.folder.name, 'catalog.db')
+        self.lookup_file = os.path.join(self.folder.name, 'transformed_nmi_info.csv')
+        os.makedirs(self.consumption_folder)
+        pd.DataFrame({'NMI': ['NMIB1', 'NMIB2'], 'STATE': ['NSW', 'VIC'],
+                      'INTERVAL': [30, 30]}).to_csv(self.lookup_file, index=None)
+        times = pd.date_range('2021-01-01', periods=48, freq='30T').delete([10, 11])
+        df = pd.DataFrame({'AESTTime': times.strftime('%Y-%m-%d %H:%M:%S'), 'Quantity': 1.0, 'Unit': 'kWh'})
+        df.to_csv(os.path.join(self.consumption_folder, 'NMIB1.csv'), index=None)
+        df.to_csv(os.path.join(self.consumption_folder, 'NMIB2.csv'), sep=';', index=None)
+        self.file_dict = {os.path.basename(path).split('.')[0]: path
+                          for path in glob.glob(os.path.join(self.consumption_folder, '*.csv'))}
+
+    def tearDown(self):
+        dh.close_connection(self.catalog_db)
+        self.folder.cleanup()
+
+    def test_16_catalog_tracks_source_files(self):
+        """
+        Test catalog is written during transform and tracks the source files, not the normalized copies
+        """
+        with mock.patch.object(dth.fh, 'get_file_dict', return_value=self.file_dict):
+            dth.transform_consumption(self.consumption_folder, output_folder=self.output_folder,
+                                      lookup_file=self.lookup_file, star_schema=True,
+                                      normalized_folder=os.path.join(self.folder.name, 'Normalized'),
+                                      catalog_db=self.catalog_db)
+        conn = dh.get_connection(self.catalog_db)
+        stats = dh.get_nmi_stats(conn)
+        actual = [dh.get_stale_nmis(conn, self.file_dict), [(row['NMI'], row['ROWS'], row['GAPS'], row['MISSING_INTERVALS']) for row in stats]]
+        expected = [[], [('NMIB1', 46, 1, 2), ('NMIB2', 46, 1, 2)]]
+        self.assertEqual(actual, expected)
+
+class StarSchemaJoinTest(unittest.TestCase):
+    def setUp(self):
+        print("Star Schema Join Test Data Setup Called...")
+        self.folder = tempfile.TemporaryDirectory()
+        self.consumption_folder = os.path.join(self.folder.name, 'ConsumptionData')
+        self.output_folder = os.path.join(self.folder.name, 'Transformed') + os.sep
+        self.database = os.path.join(self.folder.name, 'consumption.db')
+        self.lookup_file = os.path.join(self.folder.name, 'transformed_nmi_info.csv')
+        os.makedirs(self.consumption_folder)
+        pd.DataFrame({'NMI': ['NMIC1', 'NMIC2'], 'STATE': ['SA', 'NSW'],
+                      'INTERVAL': [60, 60]}).to_csv(self.lookup_file, index=None)
+        times = pd.date_range('2021-01-01', periods=48, freq='60T')
+        df = pd.DataFrame({'AESTTime': times.strftime('%Y-%m-%d %H:%M:%S'), 'Quantity': 1.0, 'Unit': 'kWh'})
+        self.file_dict = {}
+        for name in ['NMIC1', 'NMIC2']:
+            self.file_dict[name] = os.path.join(self.consumption_folder, f'{name}.csv')
+            df.to_csv(self.file_dict[name], index=None)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_17_hourly_sa_nmi_joins_calendar(self):
+        """
+        Test every consumption row of an hourly SA NMI, whose local time is at half past, joins the calendar
+        """
+        with mock.patch.object(dth.fh, 'get_file_dict', return_value=self.file_dict):
+            dth.transform_consumption(self.consumption_folder, output_folder=self.output_folder,
+                                      lookup_file=self.lookup_file, star_schema=True, database=self.database)
+        conn = dh.create_connection(self.database)
+        actual = conn.execute("""SELECT c.NMI, COUNT(*) FROM consumption c
+                                 JOIN calendar d ON d.CALENDAR_KEY = c.CALENDAR_KEY
+                                 GROUP BY c.NMI ORDER BY c.NMI""").fetchall()
+        conn.close()
+        expected = [('NMIC1', 48), ('NMIC2', 48)]
+        self.assertEqual(actual, expected)
+
+class OutOfCoreTest(unittest.TestCase):
+    def setUp(self):
+        print("Out Of Core Test Data Setup Called...")
+        self.folder = tempfile.TemporaryDirectory()
+        self.consumption_folder = os.path.join(self.folder.name, 'ConsumptionData')
+        self.lookup_file = os.path.join(self.folder.name, 'transformed_nmi_info.csv')
+        os.makedirs(self.consumption_folder)
+        pd.DataFrame({'NMI': ['NMID1', 'NMID2', 'NMID3'], 'STATE': ['NSW', 'SA', 'QLD'],
+                      'INTERVAL': [30, 30, 15]}).to_csv(self.lookup_file, index=None)
+        self.file_dict = {}
+        for name, periods, freq in [('NMID1', 96, '30T'), ('NMID2', 96, '30T'), ('NMID3', 192, '15T')]:
+            times = pd.date_range('2021-03-01', periods=periods, freq=freq)
+            df = pd.DataFrame({'AESTTime': times.strftime('%Y-%m-%d %H:%M:%S'),
+                               'Quantity': [float(i % 7) for i in range(periods)], 'Unit': 'kWh'})
+            self.file_dict[name] = os.path.join(self.consumption_folder, f'{name}.csv')
+            df.to_csv(self.file_dict[name], index=None)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_18_out_of_core_matches_in_memory(self):
+        """
+        Test out-of-core transform exports every row and aggregates the same hourly totals as the in-memory transform
+        """
+        output_folder = os.path.join(self.folder.name, 'OutOfCore') + os.sep
+        database = os.path.join(self.folder.name, 'consumption.db')
+        with mock.patch.object(dth.fh, 'get_file_dict', return_value=self.file_dict):
+            expected_df = dth.transform_consumption(self.consumption_folder, output_folder=os.path.join(self.folder.name, 'InMemory') + os.sep,
+                                                    lookup_file=self.lookup_file, star_schema=True)
+            dth.transform_consumption_out_of_core(self.consumption_folder, output_folder=output_folder, lookup_file=self.lookup_file,
+                                                  staging_db=os.path.join(self.folder.name, 'staging.db'), memory_budget_mb=1,
+                                                  star_schema=True, database=database)
+        merged_df = pd.read_csv(output_folder + 'transformed_consumption_data_merged.csv')
+        hour_start = expected_df['TRANSFORMED_AESTTIME'].dt.floor('H').astype(str)
+        expected_hourly = expected_df.groupby(['NMI', hour_start])['QUANTITY'].sum()
+        conn = dh.create_connection(database)
+        hourly_df = pd.read_sql("SELECT NMI, HOUR_START, TOTAL_CONSUMPTION FROM hourly_consumption ORDER BY NMI, HOUR_START", conn)
+        conn.close()
+        actual = [len(merged_df), hourly_df['TOTAL_CONSUMPTION'].round(6).to_list(), hourly_df['HOUR_START'].to_list()]
+        expected = [len(expected_df), expected_hourly.round(6).to_list(), expected_hourly.index.get_level_values(1).to_list()]
+        self.assertEqual(actual, expected)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
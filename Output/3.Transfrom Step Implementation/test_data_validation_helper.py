@@ -0,0 +1,191 @@
+# Date: 19/10/2026
+# This module is built to do unit test for preflight validation job
+
+import data_validation_helper as dvh
+import database_helper as dh
+import unittest
+import contextlib
+import io
+import os
+import tempfile
+import pandas as pd
+
+def _write_consumption(folder, name, rows, unit='kWh', sep=','):
+    path = os.path.join(folder, f'{name}.csv')
+    df = pd.DataFrame({'AESTTime': pd.date_range('2021-01-01', periods=rows, freq='30T').strftime('%Y-%m-%d %H:%M:%S'),
+                       'Quantity': [float(i % 10) for i in range(rows)],
+                       'Unit': unit})
+    df.to_csv(path, sep=sep, index=False)
+    return path
+
+class PreflightTest(unittest.TestCase):
+    def setUp(self):
+        print("Preflight Test Data Setup Called...")
+        self.folder = tempfile.TemporaryDirectory()
+        self.small = _write_consumption(self.folder.name, 'NMIA1', 50)
+        self.large = _write_consumption(self.folder.name, 'NMIA2', 5000)
+        self.semicolon = _write_consumption(self.folder.name, 'NMIA3', 5000, sep=';')
+        self.bad_unit = _write_consumption(self.folder.name, 'NMIA4', 5000, unit='GWh')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def _preflight(self, file_dict, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return dvh.preflight_check(file_dict, **kwargs)
+
+    def test_0_small_file_is_exact(self):
+        """
+        Test a clean file covered by the sample is exact and not escalated
+        """
+        for method in ['stratified', 'reservoir']:
+            report = self._preflight({'NMIA1': self.small}, method=method)['NMIA1']
+            actual = [report['exact'], report['suspicious'], report['rows'], report['checks']['unit_value']['sampled']]
+            expected = [True, False, 50, 50]
+            self.assertEqual(actual, expected)
+
+    def test_1_reservoir_counts_distinct_rows(self):
+        """
+        Test reservoir sample counts each sampled row once and the exact row count
+        """
+        report = self._preflight({'NMIA2': self.large}, method='reservoir', sample_size=200, tolerance=0.05, seed=1)['NMIA2']
+        actual = [report['exact'], report['rows'], report['checks']['unit_value']['sampled'], report['checks']['frequency']['sampled']]
+        expected = [False, 5000, 200, 200]
+        self.assertEqual(actual, expected)
+
+    def test_2_stratified_passes_clean_file(self):
+        """
+        Test stratified sample of a clean file is not suspicious
+        """
+        report = self._preflight({'NMIA2': self.large})['NMIA2']
+        actual = [report['exact'], report['suspicious'], report['interval']]
+        expected = [False, False, 30.0]
+        self.assertEqual(actual, expected)
+
+    def test_3_delimiter_detection(self):
+        """
+        Test semicolon delimited file is detected from the file head
+        """
+        report = self._preflight({'NMIA3': self.semicolon})['NMIA3']
+        actual = [report['delimiter'], report['header_valid'], report['suspicious']]
+        expected = [';', True, False]
+        self.assertEqual(actual, expected)
+
+    def test_4_bad_unit_is_escalated(self):
+        """
+        Test unexpected unit makes the file suspicious and runs the full scan
+        """
+        report = self._preflight({'NMIA4': self.bad_unit})['NMIA4']
+        actual = [report['suspicious'], report['full_scan'], report['checks']['unit_value']['failures'] > 0]
+        expected = [True, True, True]
+        self.assertEqual(actual, expected)
+
+    def test_5_full_scan_unit_check_agrees(self):
+        """
+        Test full scan compares units with the same case rule as the sample
+        """
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            dvh._full_scan(self.small, 'NMIA1', ['AESTTime', 'Quantity', 'Unit'], ['WH', 'KWH', 'MWH'])
+        actual = "The Unit in NMIA1 has correct value" in output.getvalue()
+        expected = True
+        self.assertEqual(actual, expected)
+
+    def test_8_reservoir_header_only_file(self):
+        """
+        Test reservoir sample of a file without data rows is reported, not crashed on
+        """
+        empty = _write_consumption(self.folder.name, 'NMIA5', 0)
+        report = self._preflight({'NMIA5': empty}, method='reservoir', full_scan=False)['NMIA5']
+        actual = [report['rows'], report['exact'], report['suspicious']]
+        expected = [0, True, True]
+        self.assertEqual(actual, expected)
+
+    def test_9_master_interval_string(self):
+        """
+        Test intervals read from the master file as strings are accepted
+        """
+        report = self._preflight({'NMIA2': self.large}, interval_dict={'NMIA2': '30'})['NMIA2']
+        actual = [report['interval'], report['suspicious']]
+        expected = [30.0, False]
+        self.assertEqual(actual, expected)
+
+    def test_10_sample_size_too_small_for_tolerance(self):
+        """
+        Test a sample too small to ever pass tolerance is rejected and a matching tolerance passes
+        """
+        with self.assertRaises(ValueError):
+            self._preflight({'NMIA2': self.large}, sample_size=200)
+        report = self._preflight({'NMIA2': self.large}, sample_size=200, tolerance=0.05)['NMIA2']
+        actual = [report['exact'], report['suspicious']]
+        expected = [False, False]
+        self.assertEqual(actual, expected)
+
+class CatalogCheckTest(unittest.TestCase):
+    def setUp(self):
+        print("Catalog Check Test Data Setup Called...")
+        self.folder = tempfile.TemporaryDirectory()
+        self.catalog_db = os.path.join(self.folder.name, 'catalog.db')
+        self.changed = _write_consumption(self.folder.name, 'NMIA1', 50)
+        self.unchanged = _write_consumption(self.folder.name, 'NMIA2', 50)
+        stat = os.stat(self.unchanged)
+        stats = pd.DataFrame([{'NMI': 'NMIA1', 'ROWS': 40, 'FIRST_LOCALTIME': '2021-01-01 01:00:00', 'LAST_LOCALTIME': '2021-01-02 01:00:00',
+                               'INTERVAL': 30.0, 'OUTLIERS': 0, 'GAPS': 1, 'MISSING_INTERVALS': 10,
+                               'SOURCE_PATH': self.changed, 'SOURCE_SIZE': 0, 'SOURCE_MTIME': 0.0},
+                              {'NMI': 'NMIA2', 'ROWS': 50, 'FIRST_LOCALTIME': '2021-01-01 01:00:00', 'LAST_LOCALTIME': '2021-01-02 01:30:00',
+                               'INTERVAL': 30.0, 'OUTLIERS': 2, 'GAPS': 0, 'MISSING_INTERVALS': 0,
+                               'SOURCE_PATH': self.unchanged, 'SOURCE_SIZE': stat.st_size, 'SOURCE_MTIME': stat.st_mtime}])
+        dh.upsert_dataframe(dh.get_connection(self.catalog_db), stats, table='nmi_stats', key_columns=['NMI'])
+
+    def tearDown(self):
+        dh.close_connection(self.catalog_db)
+        self.folder.cleanup()
+
+    def test_6_check_catalog(self):
+        """
+        Test catalog checks report interval, gaps and outliers without reading files
+        """
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            dvh.check_catalog(self.catalog_db, {'NMIA1': 30.0, 'NMIA2': 15.0})
+        actual = [line for line in output.getvalue().splitlines() if 'rows from' not in line]
+        expected = ['NMIA1 has consistent data with interval 30.0 minutes defined in the master file.',
+                    'NMIA1 has gaps as 1 with 10 missing intervals.',
+                    'NMIA1 does not have outliers.',
+                    'NMIA2 has inconsistent data with interval 15.0 minutes defined in the master file.',
+                    'NMIA2 does not have gaps.',
+                    'NMIA2 has outliers as 2.']
+        self.assertEqual(actual, expected)
+
+    def test_7_preflight_uses_catalog_for_unchanged_files(self):
+        """
+        Test unchanged files take gaps from the catalog and keep the raw row count from the sample
+        """
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = dvh.preflight_check({'NMIA1': self.changed, 'NMIA2': self.unchanged}, catalog_db=self.catalog_db,
+                                         method='reservoir', full_scan=False)
+        actual = [[result[name]['catalog'], result[name]['rows'], result[name].get('catalog_rows'), result[name]['suspicious']]
+                  for name in ['NMIA1', 'NMIA2']]
+        expected = [[False, 50, None, False], [True, 50, 50, False]]
+        self.assertEqual(actual, expected)
+
+    def test_11_catalog_does_not_vouch_for_raw_values(self):
+        """
+        Test an unchanged file with a bad unit, catalog gaps or a catalog interval mismatch is still suspicious
+        """
+        bad_unit = _write_consumption(self.folder.name, 'NMIA3', 50, unit='GWh')
+        rows = []
+        for name, path, gaps in [('NMIA1', self.changed, 1), ('NMIA3', bad_unit, 0)]:
+            stat = os.stat(path)
+            rows.append({'NMI': name, 'ROWS': 50, 'INTERVAL': 30.0, 'OUTLIERS': 0, 'GAPS': gaps, 'MISSING_INTERVALS': gaps,
+                         'SOURCE_PATH': path, 'SOURCE_SIZE': stat.st_size, 'SOURCE_MTIME': stat.st_mtime})
+        dh.upsert_dataframe(dh.get_connection(self.catalog_db), pd.DataFrame(rows), table='nmi_stats', key_columns=['NMI'])
+        file_dict = {'NMIA1': self.changed, 'NMIA2': self.unchanged, 'NMIA3': bad_unit}
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = dvh.preflight_check(file_dict, catalog_db=self.catalog_db, interval_dict={'NMIA2': '15'}, full_scan=False)
+        actual = [[result[name]['catalog'], result[name]['suspicious']] for name in file_dict]
+        expected = [[True, True], [True, True], [True, True]]
+        self.assertEqual(actual, expected)
+
+if __name__ == '__main__':
+    unittest.main()
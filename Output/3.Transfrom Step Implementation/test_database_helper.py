@@ -0,0 +1,218 @@
+# Date: 19/10/2026
+# This module is built to do unit test for database helper job
+
+import database_helper as dh
+import unittest
+import contextlib
+import io
+import sqlite3
+import os
+import tempfile
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        print("Query Test Data Setup Called...")
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute("CREATE TABLE consumption (NMI TEXT, AESTTIME TEXT, STATE TEXT, QUANTITY REAL)")
+        rows = [('NMIA1', '2021-01-01 00:00:00', 'NSW', None),
+                ('NMIA1', '2021-01-01 00:30:00', 'NSW', None),
+                ('NMIA2', '2021-01-01 00:00:00', 'VIC', 1.5),
+                ('NMIA2', '2021-01-02 00:00:00', 'VIC', 2.5)]
+        self.conn.executemany("INSERT INTO consumption VALUES (?, ?, ?, ?)", rows)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_0_filters(self):
+        """
+        Test NMI, date range and STATE filters are parameterized
+        """
+        sql, params = dh.select_consumption(['NMI'], nmi_list=['NMIA1', 'NMIA2'], start_date='2021-01-01',
+                                            end_date='2021-01-02', state='VIC')
+        actual = self.conn.execute(sql, params).fetchall()
+        expected = [('NMIA2',)]
+        self.assertEqual(actual, expected)
+
+    @unittest.skipIf(pa is None, "pyarrow is not installed")
+    def test_1_arrow_batches_same_schema(self):
+        """
+        Test Arrow batches keep one schema when the first batch is all null
+        """
+        batches = list(dh.query_arrow_batches(self.conn, "SELECT NMI, QUANTITY FROM consumption", batch_size=2))
+        table = pa.Table.from_batches(batches)
+        actual = [str(table.schema.field('QUANTITY').type), table.num_rows]
+        expected = ['double', 4]
+        self.assertEqual(actual, expected)
+
+class UpsertTest(unittest.TestCase):
+    def setUp(self):
+        print("Upsert Test Data Setup Called...")
+        self.conn = sqlite3.connect(':memory:')
+        times = pd.date_range('2021-01-01', periods=4, freq='30T')
+        self.df = pd.DataFrame({'NMI': 'NMIA1', 'AESTTIME': times, 'QUANTITY': [1.0, 2.0, 3.0, 4.0],
+                                'TIME': times.time, 'OUTLIER': [0, 0, 0, 1]})
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _tables_and_indexes(self):
+        return sorted(self.conn.execute("SELECT type, name FROM sqlite_master UNION ALL "
+                                        "SELECT type, name FROM sqlite_temp_master").fetchall())
+
+    def test_2_upsert_counts(self):
+        """
+        Test inserted, updated and unchanged counts of a delta load
+        """
+        first = dh.upsert_dataframe(self.conn, self.df)
+        delta = self.df.iloc[1:].copy()
+        delta.loc[delta.index[0], 'QUANTITY'] = 20.0
+        delta = pd.concat([delta, pd.DataFrame({'NMI': ['NMIA2'], 'AESTTIME': [pd.Timestamp('2021-01-01')],
+                                                'QUANTITY': [5.0], 'OUTLIER': [0]})])
+        second = dh.upsert_dataframe(self.conn, delta, batch_size=2)
+        actual = [first, second, self.conn.execute("SELECT COUNT(*), SUM(QUANTITY) FROM consumption").fetchone()]
+        expected = [{'inserted': 4, 'updated': 0, 'unchanged': 0},
+                    {'inserted': 1, 'updated': 1, 'unchanged': 2},
+                    (5, 33.0)]
+        self.assertEqual(actual, expected)
+
+    def test_3_upsert_unchanged_after_to_sql(self):
+        """
+        Test rows loaded by to_sql compare equal when upserted again
+        """
+        self.df.to_sql('consumption', self.conn, index=False)
+        actual = dh.upsert_dataframe(self.conn, self.df)
+        expected = {'inserted': 0, 'updated': 0, 'unchanged': 4}
+        self.assertEqual(actual, expected)
+
+    def test_4_upsert_repeated_key(self):
+        """
+        Test a key repeated in the input is counted once and keeps the last row
+        """
+        df = pd.concat([self.df.iloc[:1], self.df.iloc[:1].assign(QUANTITY=9.0)])
+        actual = [dh.upsert_dataframe(self.conn, df), self.conn.execute("SELECT QUANTITY FROM consumption").fetchall()]
+        expected = [{'inserted': 1, 'updated': 0, 'unchanged': 0}, [(9.0,)]]
+        self.assertEqual(actual, expected)
+
+    def test_5_upsert_single_key_index(self):
+        """
+        Test upsert and create_indexes share one unique index on (NMI, AESTTIME) and leave no staging table
+        """
+        self.df.assign(STATE='NSW').to_sql('consumption', self.conn, index=False)
+        dh.create_indexes(self.conn)
+        dh.upsert_dataframe(self.conn, self.df.assign(STATE='NSW'))
+        actual = self._tables_and_indexes()
+        expected = [('index', 'idx_consumption_nmi_time'), ('index', 'idx_consumption_state_time'),
+                    ('table', 'consumption')]
+        self.assertEqual(actual, expected)
+
+    def test_6_upsert_failed_batch_rolls_back(self):
+        """
+        Test a failing batch is rolled back, counts cover committed batches and staging is dropped
+        """
+        dh.upsert_dataframe(self.conn, self.df)
+        delta = self.df.copy()
+        delta['QUANTITY'] = pd.Series([0.0, 0.0, [1.0], 0.0], dtype=object)
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = dh.upsert_dataframe(self.conn, delta, batch_size=2)
+        actual = [result, self.conn.execute("SELECT SUM(QUANTITY) FROM consumption").fetchone()[0], self._tables_and_indexes()]
+        expected = [{'inserted': 0, 'updated': 2, 'unchanged': 0}, 7.0,
+                    [('index', 'idx_consumption_key'), ('table', 'consumption')]]
+        self.assertEqual(actual, expected)
+
+    def test_10_upsert_duplicate_keys_keep_index(self):
+        """
+        Test a table repeating a key keeps its non-unique index and upsert raises instead of returning zero counts
+        """
+        pd.concat([self.df, self.df]).to_sql('consumption', self.conn, index=False)
+        self.conn.execute("CREATE INDEX idx_consumption_nmi_time ON consumption (NMI, AESTTIME)")
+        with contextlib.redirect_stdout(io.StringIO()):
+            dh.create_indexes(self.conn)
+        with self.assertRaises(sqlite3.IntegrityError):
+            dh.upsert_dataframe(self.conn, self.df)
+        actual = [self._tables_and_indexes(), dh.upsert_dataframe(None, self.df)]
+        expected = [[('index', 'idx_consumption_nmi_time'), ('table', 'consumption')],
+                    {'inserted': 0, 'updated': 0, 'unchanged': 0}]
+        self.assertEqual(actual, expected)
+
+class CopyTablesTest(unittest.TestCase):
+    def setUp(self):
+        print("Copy Tables Test Data Setup Called...")
+        self.folder = tempfile.TemporaryDirectory()
+        self.source_db = os.path.join(self.folder.name, 'staging.db')
+        self.target_db = os.path.join(self.folder.name, 'report.db')
+        conn = sqlite3.connect(self.source_db)
+        conn.execute("CREATE TABLE consumption (NMI TEXT, AESTTIME TEXT, STATE TEXT, CALENDAR_KEY INTEGER, QUANTITY REAL)")
+        conn.execute("CREATE TABLE calendar (CALENDAR_KEY INTEGER, HOUR INTEGER)")
+        conn.execute("INSERT INTO consumption VALUES ('NMIA1', '2021-01-01 00:00:00', 'NSW', 202101010100, 1.0)")
+        conn.commit()
+        dh.create_indexes(conn)
+        conn.close()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_7_copy_keeps_indexes(self):
+        """
+        Test copied report tables get the report indexes in the target database
+        """
+        dh.copy_tables(self.source_db, self.target_db, ['consumption', 'calendar'])
+        conn = sqlite3.connect(self.target_db)
+        actual = sorted(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+        conn.close()
+        expected = ['idx_calendar_key', 'idx_consumption_calendar', 'idx_consumption_nmi_time', 'idx_consumption_state_time']
+        self.assertEqual(actual, expected)
+
+class CatalogTest(unittest.TestCase):
+    def setUp(self):
+        print("Catalog Test Data Setup Called...")
+        self.folder = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(':memory:')
+        self.file_dict = {}
+        rows = []
+        for name, state, gaps in [('NMIA1', 'NSW', 0), ('NMIA2', 'VIC', 2), ('NMIA3', 'VIC', 0)]:
+            path = os.path.join(self.folder.name, f'{name}.csv')
+            with open(path, 'w') as f:
+                f.write('AESTTime,Quantity,Unit\n')
+            stat = os.stat(path)
+            self.file_dict[name] = path
+            rows.append({'NMI': name, 'STATE': state, 'ROWS': 10, 'GAPS': gaps,
+                         'SOURCE_PATH': path, 'SOURCE_SIZE': stat.st_size, 'SOURCE_MTIME': stat.st_mtime})
+        dh.upsert_dataframe(self.conn, pd.DataFrame(rows[:2]), table='nmi_stats', key_columns=['NMI'])
+        dh.upsert_dataframe(self.conn, pd.DataFrame(rows[2:]), table='nmi_stats', key_columns=['NMI'])
+
+    def tearDown(self):
+        self.conn.close()
+        self.folder.cleanup()
+
+    def test_8_catalog_query(self):
+        """
+        Test catalog rows are filtered by NMI, STATE and gaps
+        """
+        actual = [[stats['NMI'] for stats in dh.get_nmi_stats(self.conn)],
+                  [stats['NMI'] for stats in dh.get_nmi_stats(self.conn, state='VIC')],
+                  [stats['NMI'] for stats in dh.get_nmi_stats(self.conn, gaps_only=True)],
+                  [stats['NMI'] for stats in dh.get_nmi_stats(self.conn, nmi_list=['NMIA1', 'NMIA3'], gaps_only=True)]]
+        expected = [['NMIA1', 'NMIA2', 'NMIA3'], ['NMIA2', 'NMIA3'], ['NMIA2'], []]
+        self.assertEqual(actual, expected)
+
+    def test_9_stale_nmis(self):
+        """
+        Test only changed or new source files are stale
+        """
+        with open(self.file_dict['NMIA2'], 'a') as f:
+            f.write('2021-01-01 00:00:00,1.0,kWh\n')
+        new_path = os.path.join(self.folder.name, 'NMIA4.csv')
+        with open(new_path, 'w') as f:
+            f.write('AESTTime,Quantity,Unit\n')
+        actual = dh.get_stale_nmis(self.conn, dict(self.file_dict, NMIA4=new_path))
+        expected = ['NMIA2', 'NMIA4']
+        self.assertEqual(actual, expected)
+
+if __name__ == '__main__':
+    unittest.main()